@@ -0,0 +1,203 @@
+import argparse
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import http_cache
+import metrics
+import payloads
+from forks_and_stars import (
+    BUDGET, BATCH_SECONDS, BATCH_SIZE, CSV_OUTPUT_FILE, LANGUAGES, LOCAL_DB_FILE, MAX_SEARCH_PAGE,
+    NUM_CONTRIBUTORS, NUM_REPOS, PER_PAGE, SORT_ORDERS, SYNCHRONOUS, BatchWriter, configure_connection,
+    create_tables, export_to_csv, fetch_contributors, fetch_repos, get_processed_repos, get_repo_states, needs_fetch,
+)
+from search_shards import SHARD_LIMIT, plan_shards
+
+MAX_IN_FLIGHT = 8
+
+
+# same crawl as forks_and_stars.crawl_pipeline, but on an event loop with every
+# language/sort pair at once. http calls go through a bounded thread pool (so at
+# most max_in_flight requests are open) and all of them draw from one rate limit budget.
+# db writes go through a BatchWriter on the event loop thread, so sqlite only
+# ever sees one writer.
+class AsyncCrawler:
+    def __init__(self, cursor, max_in_flight=MAX_IN_FLIGHT, budget=None, writer=None, refresh=False):
+        self.cursor = cursor
+        self.refresh = refresh
+        self.writer = writer or BatchWriter(cursor)
+        self.budget = budget or BUDGET
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self.claimed = set()  # repo ids picked up this run, across all pairs
+
+    async def _call(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, budget=self.budget, **kwargs))
+
+    async def crawl_all(self, languages=LANGUAGES, sort_orders=SORT_ORDERS, num_repos=NUM_REPOS, sharded=False):
+        crawl = self.crawl_sharded if sharded else self.crawl_criteria
+        await asyncio.gather(*(
+            crawl(language, sort_by, num_repos)
+            for language in languages
+            for sort_by in sort_orders
+        ))
+        self.writer.flush()
+
+    async def crawl_criteria(self, language, sort_by, num_repos=NUM_REPOS):
+        print(f'grabbing high {sort_by} repos with {language}...')
+        processed_repos = get_processed_repos(self.cursor, language, sort_by)
+        collected_repos = 0
+        page = 1
+
+        while collected_repos < num_repos and page <= MAX_SEARCH_PAGE:
+            # only ask for as many pages as could still be needed
+            pages_needed = -(-(num_repos - collected_repos) // PER_PAGE)
+            window = range(page, min(page + pages_needed, MAX_SEARCH_PAGE + 1))
+            pages = await asyncio.gather(*(
+                self._call(fetch_repos, language, sort_by=sort_by, per_page=PER_PAGE, page=p)
+                for p in window
+            ))
+            page = window.stop
+
+            if not any(pages):
+                print(f"no more repos ({language}, {sort_by})")
+                break
+
+            hits = [repo for items in pages for repo in items]
+            states = self.repo_states(hits)
+            fresh = []
+            for repo in hits:
+                if collected_repos + len(fresh) >= num_repos:
+                    break
+                if repo.id in self.claimed or not needs_fetch(repo, processed_repos, states):
+                    print(f"skipping prev inserted repo: {repo.name}")
+                    continue
+                self.claimed.add(repo.id)
+                fresh.append(repo)
+
+            await asyncio.gather(*(self.store_repo(repo, language, sort_by) for repo in fresh))
+            collected_repos += len(fresh)
+
+    # past the 1000 result cap: walk star/fork range shards (see search_shards)
+    # from the top down. shards are planned one at a time and crawled as soon as
+    # they're planned, just enough of them to cover what's still missing.
+    async def crawl_sharded(self, language, sort_by, num_repos=NUM_REPOS):
+        print(f'grabbing high {sort_by} repos with {language} (sharded)...')
+        processed_repos = get_processed_repos(self.cursor, language, sort_by)
+        shards = plan_shards(language, sort_by, budget=self.budget)
+        loop = asyncio.get_running_loop()
+        progress = {'collected': 0}
+        exhausted = False
+
+        while progress['collected'] < num_repos and not exhausted:
+            tasks = []
+            capacity = 0
+            while capacity < num_repos - progress['collected']:
+                shard = await loop.run_in_executor(self.executor, next, shards, None)
+                if shard is None:
+                    exhausted = True
+                    break
+                capacity += min(shard.total_count, SHARD_LIMIT)
+                tasks.append(asyncio.create_task(
+                    self.crawl_shard(language, sort_by, shard, processed_repos, progress, num_repos)
+                ))
+            await asyncio.gather(*tasks)
+
+        print(f"{language}, {sort_by}: {progress['collected']} new repos")
+
+    async def crawl_shard(self, language, sort_by, shard, processed_repos, progress, num_repos):
+        pages = await asyncio.gather(*(
+            self._call(fetch_repos, language, sort_by=sort_by, per_page=PER_PAGE, page=p, qualifiers=shard.qualifiers)
+            for p in range(1, shard.pages + 1)
+        ))
+        hits = [repo for items in pages for repo in items]
+        states = self.repo_states(hits)
+        fresh = []
+        for repo in hits:
+            if progress['collected'] >= num_repos:
+                break
+            # repos can drift between shards mid-crawl, the claimed set catches repeats
+            if repo.id in self.claimed or not needs_fetch(repo, processed_repos, states):
+                continue
+            self.claimed.add(repo.id)
+            fresh.append(repo)
+            progress['collected'] += 1
+        await asyncio.gather(*(self.store_repo(repo, language, sort_by) for repo in fresh))
+
+    def repo_states(self, repos):
+        return get_repo_states(self.cursor, (repo.id for repo in repos)) if self.refresh else None
+
+    async def store_repo(self, repo, language, sort_by):
+        try:
+            contributors = await self._call(fetch_contributors, repo.owner, repo.name, NUM_CONTRIBUTORS)
+            self.writer.add(repo, contributors, language, sort_by)
+
+        except Exception as e:
+            print(f"error processing repo {repo.name}: {e}")
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='crawl every language/sort pair concurrently')
+    parser.add_argument('--max-in-flight', type=int, default=MAX_IN_FLIGHT)
+    parser.add_argument('--num-repos', type=int, default=NUM_REPOS)
+    parser.add_argument('--db', default=LOCAL_DB_FILE)
+    parser.add_argument('--languages', nargs='+', default=LANGUAGES)
+    parser.add_argument('--refresh', action='store_true',
+                        help='also re-crawl already processed repos whose stars/forks/updated_at changed')
+    parser.add_argument('--shard', action='store_true',
+                        help='split searches into star/fork ranges to get past the 1000 result cap')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--batch-seconds', type=float, default=BATCH_SECONDS)
+    parser.add_argument('--synchronous', default=SYNCHRONOUS, choices=['OFF', 'NORMAL', 'FULL'])
+    parser.add_argument('--metrics-file', help='write stage timings/counters here in prometheus text format')
+    parser.add_argument('--profile', metavar='FILE', help='run under cProfile and dump the stats here')
+    parser.add_argument('--archive', metavar='DIR',
+                        help='also log every raw api response to gzipped segments in this directory (see replay.py)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    profiler = metrics.start_profile(args.profile)
+    payloads.open_archive(args.archive)
+
+    conn = sqlite3.connect(args.db)
+    configure_connection(conn, args.synchronous)
+    cursor = conn.cursor()
+    writer = BatchWriter(cursor, batch_size=args.batch_size, max_wait=args.batch_seconds)
+    crawler = AsyncCrawler(cursor, max_in_flight=args.max_in_flight, writer=writer, refresh=args.refresh)
+
+    try:
+        create_tables(cursor)
+        conn.commit()
+
+        asyncio.run(crawler.crawl_all(args.languages, num_repos=args.num_repos, sharded=args.shard))
+
+        export_to_csv(cursor, CSV_OUTPUT_FILE)
+        print(f'CSV exported to {CSV_OUTPUT_FILE}')
+        http_cache.print_stats()
+        crawler.budget.print_stats()
+
+    except KeyboardInterrupt:
+        print('\n keyboard interruption, stopping')
+        writer.flush()
+        export_to_csv(cursor, CSV_OUTPUT_FILE)
+        conn.rollback()
+    except Exception as e:
+        print(f'error: {e}')
+        conn.rollback()
+    finally:
+        crawler.close()
+        cursor.close()
+        conn.close()
+        print('db connection closed')
+        payloads.close_archive()
+        metrics.report(args.metrics_file, profiler, args.profile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# csv vs partitioned parquet for the combined repo/contributor table.
+# run from the repo root: python benchmarks/columnar_export.py [--db new_github_repos.db]
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+import pyarrow.dataset as ds
+
+from combo_table import export_csv, export_parquet, migrate
+
+
+def dir_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+def best_of(repeat, func):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--db', default='new_github_repos.db')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    work = tempfile.mkdtemp(prefix='gitgrab_columnar_')
+    csv_path = os.path.join(work, 'combined.csv')
+    parquet_path = os.path.join(work, 'combined')
+    try:
+        with sqlite3.connect(args.db) as conn:
+            migrate(conn)
+            csv_write, _ = best_of(1, lambda: export_csv(conn, csv_path))
+            parquet_write, _ = best_of(1, lambda: export_parquet(conn, parquet_path))
+            language = conn.execute(
+                'SELECT language FROM repositories GROUP BY language ORDER BY COUNT(*) DESC LIMIT 1'
+            ).fetchone()[0]
+
+        dataset = ds.dataset(parquet_path, format='parquet', partitioning='hive')
+        results = [
+            ('write', csv_write, parquet_write),
+            ('load all', best_of(args.repeat, lambda: pd.read_csv(csv_path))[0],
+                         best_of(args.repeat, lambda: dataset.to_table().to_pandas())[0]),
+            ('load 2 columns', best_of(args.repeat, lambda: pd.read_csv(csv_path, usecols=['repo_id', 'contributor_name']))[0],
+                               best_of(args.repeat, lambda: dataset.to_table(columns=['repo_id', 'contributor_name']).to_pandas())[0]),
+            (f'load {language} only', best_of(args.repeat, lambda: (lambda df: df[df['repo_language'] == language])(pd.read_csv(csv_path)))[0],
+                                      best_of(args.repeat, lambda: dataset.to_table(filter=ds.field('repo_language') == language).to_pandas())[0]),
+        ]
+
+        print(f'\n{"":<22}{"csv":>12}{"parquet":>12}')
+        print(f'{"size (KB)":<22}{dir_size(csv_path) / 1024:>12.1f}{dir_size(parquet_path) / 1024:>12.1f}')
+        for label, csv_time, parquet_time in results:
+            print(f'{label + " (ms)":<22}{csv_time * 1000:>12.1f}{parquet_time * 1000:>12.1f}')
+    finally:
+        shutil.rmtree(work)
+
+
+if __name__ == "__main__":
+    main()
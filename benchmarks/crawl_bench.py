@@ -0,0 +1,233 @@
+# end to end timing of forks_and_stars.main and twits2.main against the local
+# stand-in in fake_api.py, no api keys needed. each target runs in its own
+# subprocess and scratch dir (fresh db, http cache and config.json) so peak rss
+# and timings don't bleed into each other.
+# run from the repo root:
+#   python benchmarks/crawl_bench.py [--latency 0.002] [--error-rate 0.01] [--compare old.json]
+# results go to crawl_bench_<commit>.json unless --out says otherwise.
+import argparse
+import functools
+import json
+import os
+import platform
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+TARGETS = ['github', 'twitter']
+TWITTER_HOST = 'https://api.twitter.com'
+DUMMY_CONFIG = {
+    'GITHUB_TOKEN': 'bench-token-0000',
+    'BEARER_TOKEN': 'bench', 'API_KEY': 'bench', 'API_SECRET_KEY': 'bench',
+    'ACCESS_TOKEN': 'bench', 'ACCESS_TOKEN_SECRET': 'bench',
+}
+# the numbers --compare lines up, and whether bigger is better for each
+COMPARED = [('wall_seconds', False), ('requests_per_second', True), ('rows_per_second', True), ('peak_rss_mb', False)]
+
+
+# cumulative seconds and calls per wrapped function. hydration runs on a thread
+# pool, so a stage's seconds can add up to more than the wall time
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, owner, name, stage=None):
+        func = getattr(owner, name)
+        stage = stage or name
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    calls, seconds = self.stages.get(stage, (0, 0.0))
+                    self.stages[stage] = (calls + 1, seconds + elapsed)
+
+        setattr(owner, name, timed)
+
+    def report(self):
+        return {stage: {'calls': calls, 'seconds': round(seconds, 4)} for stage, (calls, seconds) in self.stages.items()}
+
+
+def count_rows(db_file, tables):
+    if not os.path.exists(db_file):
+        return 0
+    with sqlite3.connect(db_file) as conn:
+        return sum(conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in tables)
+
+
+# -- child side: one target, inside its scratch dir
+
+def run_github(timer):
+    import forks_and_stars
+
+    for name in ('fetch_contributors', 'export_to_csv'):
+        timer.wrap(forks_and_stars, name)
+    timer.wrap(forks_and_stars.BatchWriter, 'flush', 'BatchWriter.flush')
+
+    # the fixture corpus only has java repos
+    forks_and_stars.main(['--db', 'bench.db', '--languages', 'Java'])
+    return count_rows('bench.db', ['repositories', 'contributors', 'processed_repos'])
+
+
+def run_twitter(timer, api_url):
+    import requests
+    import twits2
+
+    # tweepy always talks to api.twitter.com, point its session at the fake instead
+    class Redirect(requests.adapters.HTTPAdapter):
+        def send(self, request, **kwargs):
+            request.url = api_url + request.url[len(TWITTER_HOST):]
+            return super().send(request, **kwargs)
+
+    twits2.get_client().session.mount(TWITTER_HOST, Redirect())
+    for name in ('search_users', 'fetch_users', 'rank_users', 'save_to_csv'):
+        timer.wrap(twits2, name)
+
+    twits2.main([])
+    return count_rows(twits2.USER_STORE_FILE, ['hydrated_users'])
+
+
+def run_target(target, api_url, result_file):
+    timer = StageTimer()
+    start = time.perf_counter()
+    with open('bench.log', 'w') as log, redirect_stdout(log):
+        rows = run_github(timer) if target == 'github' else run_twitter(timer, api_url)
+    wall = time.perf_counter() - start
+
+    with open(result_file, 'w') as f:
+        json.dump({
+            'wall_seconds': round(wall, 4),
+            'db_rows': rows,
+            # kilobytes on linux
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'stages': timer.report(),
+        }, f)
+
+
+# -- parent side: fake server plus one subprocess per target
+
+def bench(target, api, keep=False):
+    work = tempfile.mkdtemp(prefix=f'gitgrab_bench_{target}_')
+    with open(os.path.join(work, 'config.json'), 'w') as f:
+        json.dump(DUMMY_CONFIG, f)
+    result_file = os.path.join(work, 'result.json')
+    env = {**os.environ, 'GITHUB_API_BASE': api.url, 'PYTHONPATH': REPO_ROOT}
+
+    api.reset_counters()
+    child = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-target', target,
+                            '--api', api.url, '--result-file', result_file], cwd=work, env=env)
+    if child.returncode:
+        raise SystemExit(f'{target} run failed, its output is in {work}/bench.log')
+    with open(result_file) as f:
+        result = json.load(f)
+
+    result['requests'] = api.requests
+    result['injected_errors'] = api.errors
+    result['injected_server_errors'] = api.server_errors
+    result['requests_per_second'] = round(api.requests / result['wall_seconds'], 1)
+    result['rows_per_second'] = round(result['db_rows'] / result['wall_seconds'], 1)
+    if keep:
+        print(f'{target} scratch dir kept at {work}')
+    else:
+        shutil.rmtree(work)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_results(results):
+    for target, r in results['targets'].items():
+        print(f"\n{target}: {r['wall_seconds']:.2f}s, {r['requests']} requests ({r['requests_per_second']}/s, "
+              f"{r['injected_errors']} rate limited, {r.get('injected_server_errors', 0)} 502s), {r['db_rows']} rows ({r['rows_per_second']}/s), "
+              f"peak rss {r['peak_rss_mb']} MB")
+        print(f'  {"stage":<22}{"calls":>8}{"seconds":>10}')
+        for stage, s in sorted(r['stages'].items(), key=lambda item: -item[1]['seconds']):
+            print(f'  {stage:<22}{s["calls"]:>8}{s["seconds"]:>10.3f}')
+
+
+def print_comparison(old, new):
+    print(f"\n{old['commit']} -> {new['commit']}")
+    for target in new['targets']:
+        if target not in old['targets']:
+            continue
+        print(f'  {target}')
+        for key, higher_is_better in COMPARED:
+            before, after = old['targets'][target][key], new['targets'][target][key]
+            change = (after - before) / before * 100 if before else 0
+            better = change > 0 if higher_is_better else change < 0
+            print(f'    {key:<22}{before:>10}{after:>10}{change:>+9.1f}%{"  better" if better and change else ""}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='time the github and twitter crawls against a local fake api')
+    parser.add_argument('--db', default=os.path.join(REPO_ROOT, 'new_github_repos.db'),
+                        help='recorded repos/contributors the fake server replays')
+    parser.add_argument('--targets', nargs='+', default=TARGETS, choices=TARGETS)
+    parser.add_argument('--latency', type=float, default=0.002, help='seconds added to every response')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='share of github calls answered 403 / twitter calls answered 429')
+    parser.add_argument('--server-error-rate', type=float, default=0.0, help='share of calls answered 502')
+    parser.add_argument('--out', help='results json (default crawl_bench_<commit>.json)')
+    parser.add_argument('--compare', metavar='JSON', help='earlier results to compare against')
+    parser.add_argument('--keep', action='store_true', help="don't delete the scratch dirs")
+    parser.add_argument('--run-target', choices=TARGETS, help=argparse.SUPPRESS)
+    parser.add_argument('--api', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_target:
+        run_target(args.run_target, args.api, args.result_file)
+        return
+
+    from fake_api import FakeAPI
+
+    api = FakeAPI(args.db, latency=args.latency, error_rate=args.error_rate,
+                  server_error_rate=args.server_error_rate).start()
+    try:
+        results = {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'settings': {'latency': args.latency, 'error_rate': args.error_rate,
+                         'server_error_rate': args.server_error_rate, 'corpus': os.path.basename(args.db)},
+            'targets': {target: bench(target, api, args.keep) for target in args.targets},
+        }
+    finally:
+        api.stop()
+
+    print_results(results)
+    out = args.out or f"crawl_bench_{results['commit']}.json"
+    with open(out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'\nresults written to {out}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
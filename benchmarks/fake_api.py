@@ -0,0 +1,217 @@
+# stand-in for api.github.com and api.twitter.com that replays the repos and
+# contributors recorded in a gitgrab db (new_github_repos.db by default) plus the
+# profiles in fixtures/twitter_profiles.json. sends the same rate limit headers
+# the real apis do, and can add latency, a share of rate-limited responses (403
+# for github, 429 for twitter) and a share of 502s so retry/backoff paths get
+# exercised too.
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+SEARCH_CAP = 1000
+TWEETS_PER_QUERY = 300
+
+
+def load_corpus(db_file):
+    conn = sqlite3.connect(db_file)
+    repos = [
+        {
+            'id': row[0], 'name': row[1], 'html_url': row[2], 'stargazers_count': row[3] or 0,
+            'forks_count': row[4] or 0, 'language': row[5], 'owner': {'login': row[6]},
+            'created_at': row[7], 'updated_at': row[8],
+        }
+        for row in conn.execute('SELECT id, name, url, stars, forks, language, owner, created_at, updated_at FROM repositories')
+    ]
+    contributors = {}
+    for repo_id, login, contributions in conn.execute(
+            'SELECT repo_id, contributor, contributions FROM contributors ORDER BY id'):
+        contributors.setdefault(repo_id, {})[login] = contributions
+    conn.close()
+    return repos, {
+        repo_id: [{'login': login, 'contributions': n} for login, n in logins.items()]
+        for repo_id, logins in contributors.items()
+    }
+
+
+class FakeAPI:
+    def __init__(self, db_file='new_github_repos.db', latency=0.0, error_rate=0.0, server_error_rate=0.0, port=0, seed=0):
+        self.repos, self.contributors = load_corpus(db_file)
+        self.by_path = {(r['owner']['login'], r['name']): r for r in self.repos}
+        with open(os.path.join(FIXTURES, 'twitter_profiles.json')) as f:
+            self.profiles = json.load(f)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.server_error_rate = server_error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.server_errors = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests = self.errors = self.server_errors = 0
+
+    # None, 'rate_limit' or 'server' for the request that just came in
+    def _count(self):
+        with self.lock:
+            self.requests += 1
+            roll = self.random.random()
+            if roll < self.error_rate:
+                self.errors += 1
+                return 'rate_limit'
+            if roll < self.error_rate + self.server_error_rate:
+                self.server_errors += 1
+                return 'server'
+        return None
+
+    # -- github
+
+    def search(self, query):
+        qs = query['q'][0]
+        language = re.search(r'language:(\S+)', qs).group(1)
+        repos = [r for r in self.repos if r['language'] == language]
+        for field, key in (('stars', 'stargazers_count'), ('forks', 'forks_count')):
+            for m in re.finditer(field + r':(>=?|)(\d+)(?:\.\.(\d+))?', qs):
+                op, lo, hi = m.groups()
+                lo = int(lo)
+                if hi is not None:
+                    repos = [r for r in repos if lo <= r[key] <= int(hi)]
+                elif op == '>':
+                    repos = [r for r in repos if r[key] > lo]
+                else:
+                    repos = [r for r in repos if r[key] >= lo]
+        key = 'forks_count' if query.get('sort', ['stars'])[0] == 'forks' else 'stargazers_count'
+        repos.sort(key=lambda r: -r[key])
+        page = int(query.get('page', ['1'])[0])
+        per_page = int(query.get('per_page', ['30'])[0])
+        if (page - 1) * per_page >= SEARCH_CAP:
+            return 422, {'message': 'Only the first 1000 search results are available'}
+        return 200, {'total_count': len(repos), 'incomplete_results': False,
+                     'items': repos[(page - 1) * per_page: page * per_page]}
+
+    def github(self, path, query):
+        if path == '/search/repositories':
+            return self.search(query)
+        m = re.fullmatch(r'/repos/([^/]+)/([^/]+)/contributors', path)
+        if m:
+            repo = self.by_path.get(m.groups())
+            if repo is None:
+                return 404, {'message': 'Not Found'}
+            limit = int(query.get('per_page', ['30'])[0])
+            return 200, self.contributors.get(repo['id'], [])[:limit]
+        m = re.fullmatch(r'/users/([^/]+)', path)
+        if m:
+            return 200, {'login': m.group(1), 'email': None, 'blog': ''}
+        return 404, {'message': 'Not Found'}
+
+    # -- twitter
+
+    def twitter_user(self, user_id):
+        profile = self.profiles[user_id % len(self.profiles)]
+        return {
+            'id': str(user_id), 'username': f'user{user_id}', 'name': profile['name'],
+            'description': profile['description'],
+            'public_metrics': {'followers_count': (user_id * 7919) % 20000, 'following_count': 0,
+                               'tweet_count': 0, 'listed_count': 0},
+        }
+
+    def twitter(self, path, query):
+        if path == '/2/tweets/search/recent':
+            seed = int(hashlib.md5(query['query'][0].encode()).hexdigest()[:8], 16)
+            start = int(query.get('next_token', ['0'])[0])
+            count = min(int(query.get('max_results', ['10'])[0]), TWEETS_PER_QUERY - start)
+            tweets = [{'id': str(seed + i), 'text': query['query'][0], 'edit_history_tweet_ids': [str(seed + i)],
+                       'author_id': str((seed + i * 31) % 5000 + 1)} for i in range(start, start + count)]
+            meta = {'result_count': len(tweets)}
+            if start + count < TWEETS_PER_QUERY:
+                meta['next_token'] = str(start + count)
+            return 200, {'data': tweets, 'meta': meta}
+        if path == '/2/users':
+            ids = query['ids'][0].split(',')
+            return 200, {'data': [self.twitter_user(int(i)) for i in ids]}
+        return 404, {'title': 'Not Found'}
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if api.latency:
+                    time.sleep(api.latency)
+                parsed = urlparse(self.path)
+                query = parse_qs(parsed.query)
+                twitter = parsed.path.startswith('/2/')
+                reset = str(int(time.time()) + 1)
+
+                injected = api._count()
+                if injected == 'server':
+                    self.send_response(502)
+                    self.send_header('Content-Type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(b'{"message": "Server Error"}')
+                    return
+                if injected:
+                    if twitter:
+                        self.send_response(429)
+                        self.send_header('x-rate-limit-remaining', '0')
+                        self.send_header('x-rate-limit-reset', reset)
+                    else:
+                        self.send_response(403)
+                        self.send_header('X-RateLimit-Remaining', '0')
+                        self.send_header('X-RateLimit-Reset', reset)
+                    self.send_header('Content-Type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(b'{"message": "API rate limit exceeded"}')
+                    return
+
+                status, body = api.twitter(parsed.path, query) if twitter else api.github(parsed.path, query)
+                data = json.dumps(body).encode()
+                etag = '"%s"' % hashlib.md5(data).hexdigest()
+                if not twitter and self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                if twitter:
+                    self.send_header('x-rate-limit-remaining', '299')
+                    self.send_header('x-rate-limit-reset', str(int(time.time()) + 900))
+                else:
+                    self.send_header('ETag', etag)
+                    self.send_header('X-RateLimit-Resource', 'search' if '/search/' in parsed.path else 'core')
+                    self.send_header('X-RateLimit-Remaining', '4999')
+                    self.send_header('X-RateLimit-Reset', str(int(time.time()) + 3600))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
@@ -0,0 +1,107 @@
+# decode + keep a search page as dicts (what fetch_repos used to hand around)
+# vs decode + project to RepoRecords. pages are shaped like real
+# /search/repositories hits: every top level field, url templates, nested
+# owner / license / topics, pretty printed the way github sends them.
+# run from the repo root: python benchmarks/projection.py [--pages 200]
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import payloads
+
+API = 'https://api.github.com'
+URL_TEMPLATES = [
+    'forks', 'keys', 'collaborators', 'teams', 'hooks', 'issue_events', 'events', 'assignees', 'branches',
+    'tags', 'blobs', 'git_tags', 'git_refs', 'trees', 'statuses', 'languages', 'stargazers', 'contributors',
+    'subscribers', 'subscription', 'commits', 'git_commits', 'comments', 'issue_comment', 'contents',
+    'compare', 'merges', 'archive', 'downloads', 'issues', 'pulls', 'milestones', 'notifications', 'labels',
+    'releases', 'deployments',
+]
+
+
+def owner(i):
+    login = f'owner{i % 700}'
+    return {
+        'login': login, 'id': 1000 + i % 700, 'node_id': f'MDQ6VXNlcj{i:08d}',
+        'avatar_url': f'https://avatars.githubusercontent.com/u/{1000 + i % 700}?v=4', 'gravatar_id': '',
+        'type': 'Organization', 'site_admin': False, 'user_view_type': 'public',
+        **{f'{key}_url': f'{API}/users/{login}/{key}' for key in
+           ('html', 'followers', 'following', 'gists', 'starred', 'subscriptions', 'organizations', 'repos', 'events', 'received_events')},
+    }
+
+
+def item(i):
+    name = f'project-{i}'
+    full = f'owner{i % 700}/{name}'
+    return {
+        'id': 10_000_000 + i, 'node_id': f'MDEwOlJlcG9zaXRvcn{i:08d}', 'name': name, 'full_name': full,
+        'private': False, 'owner': owner(i), 'html_url': f'https://github.com/{full}',
+        'description': 'A reasonably long description of what this repository does, as most of them have. ' * 2,
+        'fork': False, 'url': f'{API}/repos/{full}',
+        **{f'{key}_url': f'{API}/repos/{full}/{key}{{/sha}}' for key in URL_TEMPLATES},
+        'created_at': '2015-03-01T10:00:00Z', 'updated_at': '2024-05-01T10:00:00Z', 'pushed_at': '2024-05-01T09:00:00Z',
+        'git_url': f'git://github.com/{full}.git', 'ssh_url': f'git@github.com:{full}.git',
+        'clone_url': f'https://github.com/{full}.git', 'svn_url': f'https://github.com/{full}',
+        'homepage': f'https://{name}.example.org', 'size': 123456, 'stargazers_count': 50_000 - i,
+        'watchers_count': 50_000 - i, 'language': 'Java', 'has_issues': True, 'has_projects': True,
+        'has_downloads': True, 'has_wiki': True, 'has_pages': False, 'has_discussions': True,
+        'forks_count': 9_000 - i, 'mirror_url': None, 'archived': False, 'disabled': False,
+        'open_issues_count': 321, 'license': {
+            'key': 'apache-2.0', 'name': 'Apache License 2.0', 'spdx_id': 'Apache-2.0',
+            'url': f'{API}/licenses/apache-2.0', 'node_id': 'MDc6TGljZW5zZTI=',
+        },
+        'allow_forking': True, 'is_template': False, 'web_commit_signoff_required': False,
+        'topics': ['java', 'framework', 'microservices', 'cloud-native', 'spring', 'distributed-systems'],
+        'visibility': 'public', 'forks': 9_000 - i, 'open_issues': 321, 'watchers': 50_000 - i,
+        'default_branch': 'main', 'score': 1.0,
+    }
+
+
+def page(n):
+    return json.dumps({'total_count': 100_000, 'incomplete_results': False,
+                       'items': [item(n * 100 + i) for i in range(100)]}, indent=2).encode()
+
+
+def as_dicts(content):
+    return json.loads(content)['items']
+
+
+def measure(parse, bodies):
+    start = time.perf_counter()
+    for body in bodies:
+        parse(body)
+    seconds = time.perf_counter() - start
+
+    # what it costs to hold every page's result at once, like a crawl with many pages in flight
+    tracemalloc.start()
+    kept = [parse(body) for body in bodies]
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return seconds, retained
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=100)
+    args = parser.parse_args()
+
+    bodies = [page(n) for n in range(args.pages)]
+    print(f'{args.pages} pages of 100 hits, {sum(map(len, bodies)) / args.pages / 1024:.0f} KB each, '
+          f'decoder: {payloads.loads.__module__}')
+    results = {
+        'dicts (json.loads)': measure(as_dicts, bodies),
+        'records (payloads.repo_page)': measure(payloads.repo_page, bodies),
+    }
+    print(f'{"":<30}{"ms/page":>10}{"retained MB":>14}')
+    for label, (seconds, retained) in results.items():
+        print(f'{label:<30}{seconds / args.pages * 1000:>10.2f}{retained / 2**20:>14.1f}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# startup cost of the gitgrab commands, from python -X importtime. each case
+# runs in a scratch dir with no config.json (and an empty db where it needs one),
+# so it also catches anything reading credentials at import. a case fails when
+# a module it shouldn't need gets imported, or its imports take longer than the
+# budget; exits 1 if any case fails. tests/test_startup.py runs the same cases under pytest.
+# run from the repo root:
+#   python benchmarks/startup.py [--budget-ms 250] [--runs 3] [--top 8]
+import argparse
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+GITGRAB = os.path.join(REPO_ROOT, 'gitgrab.py')
+
+HEAVY = ['requests', 'pandas', 'tweepy', 'pyarrow', 'numpy']
+BUDGET_MS = 250       # pandas alone is ~400 ms, tweepy ~150 ms
+
+# (name, gitgrab args, heavy modules that path is allowed to load, its own budget in ms or None)
+CASES = [
+    ('help', ['--help'], [], None),
+    ('crawl --help', ['crawl', '--help'], [], None),
+    ('crawl --engine workers --help', ['crawl', '--engine', 'workers', '--help'], [], None),
+    ('export', ['export', '--db', 'empty.db'], [], None),
+    # pyarrow alone is ~100 ms, it's what this path is for
+    ('export --combined --parquet', ['export', '--combined', '--parquet', '--db', 'empty.db'], ['pyarrow', 'numpy'], 400),
+    ('enrich --help', ['enrich', '--help'], [], None),
+    ('replay --help', ['replay', '--help'], [], None),
+    ('history list', ['history', '--store', 'empty.db', 'list'], [], None),
+]
+
+
+# importtime lines look like 'import time:  self_us |  cumulative_us | <indent>module',
+# two more spaces of indent per level of nesting
+def parse_importtime(stderr):
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        modules.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return modules
+
+
+def run_case(args, work):
+    result = subprocess.run([sys.executable, '-X', 'importtime', GITGRAB, *args],
+                            cwd=work, capture_output=True, text=True)
+    if result.returncode != 0 and '--help' not in args:
+        raise SystemExit(f'gitgrab {" ".join(args)} failed:\n{result.stdout}\n{result.stderr}')
+    return parse_importtime(result.stderr)
+
+
+def loaded(modules, package):
+    return any(name == package or name.startswith(package + '.') for name, _, _, _ in modules)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='import time regression check for the gitgrab commands')
+    parser.add_argument('--budget-ms', type=float, default=BUDGET_MS,
+                        help='max import time for commands without a budget of their own')
+    parser.add_argument('--runs', type=int, default=3, help='best of this many runs counts')
+    parser.add_argument('--top', type=int, default=8, help='slowest top level imports to list per command')
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory(prefix='gitgrab_startup_') as work:
+        sqlite3.connect(os.path.join(work, 'empty.db')).close()
+        for name, gitgrab_args, allowed, budget_ms in CASES:
+            budget_ms = budget_ms or args.budget_ms
+            runs = [run_case(gitgrab_args, work) for _ in range(args.runs)]
+            # the first run also pays for writing .pyc files and a cold disk cache
+            modules = min(runs, key=lambda modules: sum(m[1] for m in modules))
+            total_ms = sum(self_us for _, self_us, _, _ in modules) / 1000
+            heavy = [package for package in HEAVY if package not in allowed and loaded(modules, package)]
+
+            status = 'ok'
+            if heavy:
+                status = 'FAIL'
+                failures.append(f'{name}: imports {", ".join(heavy)}')
+            if total_ms > budget_ms:
+                status = 'FAIL'
+                failures.append(f'{name}: {total_ms:.0f} ms of imports, budget {budget_ms:.0f} ms')
+
+            print(f'{name:<34}{total_ms:>8.1f} ms  {len(modules):>4} modules  {status}')
+            top = sorted((m for m in modules if m[3] == 0), key=lambda m: m[2], reverse=True)[:args.top]
+            for module, _, cumulative_us, _ in top:
+                print(f'    {module:<30}{cumulative_us / 1000:>8.1f} ms')
+
+    if failures:
+        print('\n' + '\n'.join(failures))
+        sys.exit(1)
+    print(f'\nall {len(CASES)} commands start within budget, without heavy modules they don\'t need')
+
+
+if __name__ == "__main__":
+    main()
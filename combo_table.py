@@ -1,28 +1,128 @@
+import argparse
+import os
 import sqlite3
-import pandas as pd
-
-# Connect to the SQLite database
-with sqlite3.connect('github_repos.db') as conn:
-    query = '''
-    SELECT r.id AS repo_id, 
-           r.name AS repo_name, 
-           r.url AS repo_url, 
-           r.stars AS repo_stars, 
-           r.forks AS repo_forks, 
-           r.language AS repo_language, 
-           r.owner AS repo_owner, 
-           r.created_at AS repo_created_at, 
+from urllib.parse import quote
+
+DB_FILE = 'github_repos.db'
+CSV_FILE = 'combined_repos_contributors.csv'
+PARQUET_DIR = 'combined_repos_contributors'
+BATCH_ROWS = 50_000
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+QUERY = '''
+    SELECT r.id AS repo_id,
+           r.name AS repo_name,
+           r.url AS repo_url,
+           r.stars AS repo_stars,
+           r.forks AS repo_forks,
+           r.language AS repo_language,
+           r.owner AS repo_owner,
+           r.created_at AS repo_created_at,
            r.updated_at AS repo_updated_at,
            c.contributor AS contributor_name,
            c.contributions AS contributor_contributions
     FROM repositories r
     LEFT JOIN contributors c ON r.id = c.repo_id
     '''
-    
-    df_combined = pd.read_sql_query(query, conn)
-    df_unique = df_combined.drop_duplicates(keep='first')
 
 
-print(df_combined.head())
+# the join relies on (repo_id, contributor) being unique, which only holds once
+# create_tables has migrated the db (older crawls appended duplicate rows)
+def migrate(conn):
+    import forks_and_stars
+    forks_and_stars.create_tables(conn.cursor())
+    conn.commit()
+
+
+def export_csv(conn, filename=CSV_FILE):
+    # only this path needs pandas, the parquet export shouldn't wait for it to load
+    import pandas as pd
+
+    # (repo_id, contributor) is unique after migrate(), so the join can't produce duplicate rows
+    df_combined = pd.read_sql_query(QUERY, conn)
+    print(df_combined.head())
+    df_combined.to_csv(filename, index=False)
+
+
+# same join, written as parquet partitioned by language (hive style dirs, so
+# pyarrow.dataset / pandas / duckdb can prune on it). rows come off the cursor
+# batch_rows at a time and go straight out as record batches, the full join
+# never sits in memory. owner / contributor repeat a lot, so they're dictionary
+# encoded both in arrow and on disk.
+def export_parquet(conn, out_dir=PARQUET_DIR, batch_rows=BATCH_ROWS):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit('parquet export needs pyarrow (pip install pyarrow)')
+
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    schema = pa.schema([
+        ('repo_id', pa.int64()),
+        ('repo_name', pa.string()),
+        ('repo_url', pa.string()),
+        ('repo_stars', pa.int64()),
+        ('repo_forks', pa.int64()),
+        ('repo_owner', dictionary),
+        ('repo_created_at', pa.string()),
+        ('repo_updated_at', pa.string()),
+        ('contributor_name', dictionary),
+        ('contributor_contributions', pa.int64()),
+    ])
+    language_column = 5  # position of repo_language in QUERY
+
+    writers = {}
+    rows_written = 0
+    cursor = conn.execute(QUERY)
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_rows)
+            if not rows:
+                break
+            partitions = {}
+            for row in rows:
+                partitions.setdefault(row[language_column], []).append(row[:language_column] + row[language_column + 1:])
+
+            for language, part in partitions.items():
+                columns = list(zip(*part))
+                arrays = [
+                    pa.array(values, type=field.type.value_type).dictionary_encode()
+                    if pa.types.is_dictionary(field.type) else pa.array(values, type=field.type)
+                    for values, field in zip(columns, schema)
+                ]
+                if language not in writers:
+                    partition = NULL_PARTITION if language is None else quote(language, safe='')
+                    path = os.path.join(out_dir, f'repo_language={partition}')
+                    os.makedirs(path, exist_ok=True)
+                    writers[language] = pq.ParquetWriter(
+                        os.path.join(path, 'part-0.parquet'), schema,
+                        use_dictionary=['repo_owner', 'contributor_name'], compression='zstd',
+                    )
+                writers[language].write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+                rows_written += len(part)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    print(f'wrote {rows_written} rows in {len(writers)} language partitions to {out_dir}/')
+    return rows_written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='join repos with their contributors into one table')
+    parser.add_argument('--db', default=DB_FILE)
+    parser.add_argument('--parquet', action='store_true', help='write partitioned parquet instead of csv')
+    parser.add_argument('--out', help=f'output path (default {CSV_FILE} or {PARQUET_DIR}/)')
+    args = parser.parse_args(argv)
+
+    # Connect to the SQLite database
+    with sqlite3.connect(args.db) as conn:
+        migrate(conn)
+        if args.parquet:
+            export_parquet(conn, args.out or PARQUET_DIR)
+        else:
+            export_csv(conn, args.out or CSV_FILE)
+
 
-df_unique.to_csv('combined_repos_contributors.csv', index=False)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+import argparse
+import heapq
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+DB_FILE = 'github_repos.db'
+MAGIC = b'GGCSR\x00\x01\x00'
+TOP_K = 10
+
+# cheap content fingerprint, the cached index is rebuilt whenever it changes
+SIGNATURE_QUERY = '''
+    SELECT (SELECT COUNT(*) || ':' || COALESCE(SUM(stars), 0) || ':' || COALESCE(MAX(id), 0) FROM repositories)
+        || '/' ||
+        (SELECT COUNT(*) || ':' || COALESCE(SUM(contributions), 0) || ':' || COALESCE(MAX(id), 0) FROM contributors)
+'''
+REPOS_QUERY = "SELECT id, owner || '/' || name, language FROM repositories ORDER BY id"
+# old dbs can still have duplicate (repo, contributor) rows, keep the biggest count
+EDGES_QUERY = '''
+    SELECT c.contributor, c.repo_id, MAX(c.contributions)
+    FROM contributors c JOIN repositories r ON r.id = c.repo_id
+    WHERE c.contributor IS NOT NULL
+    GROUP BY c.repo_id, c.contributor
+'''
+
+
+# strings packed into one utf-8 blob plus an offsets array, indexable like a
+# list without decoding the lot. logins are stored sorted, so lookups bisect this.
+class StringTable:
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    @staticmethod
+    def pack(strings):
+        blob = bytearray()
+        offsets = array('q', [0])
+        for s in strings:
+            blob += s.encode()
+            offsets.append(len(blob))
+        return bytes(blob), offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode()
+
+
+# contributor <-> repo bipartite graph in CSR form, both directions:
+#   contributor c's repos are c_repos[c_offsets[c]:c_offsets[c + 1]] (with the
+#   matching contribution counts in c_counts), and likewise r_contributors /
+#   r_counts for repo r. repos are numbered in id order, contributors in login
+#   order, and every neighbour list is sorted, so overlaps are a merge.
+# built from sqlite once, then saved as flat arrays that load back through mmap
+# with no parsing; only the pages a query touches get read.
+class ContribIndex:
+    SECTIONS = [
+        ('repo_ids', 'q'), ('repo_langs', 'i'), ('repo_names_blob', 'B'), ('repo_names_offsets', 'q'),
+        ('logins_blob', 'B'), ('logins_offsets', 'q'),
+        ('c_offsets', 'q'), ('c_repos', 'i'), ('c_counts', 'i'),
+        ('r_offsets', 'q'), ('r_contributors', 'i'), ('r_counts', 'i'),
+    ]
+
+    def __init__(self, languages, signature, arrays, mapped=None):
+        self.languages = languages
+        self.signature = signature
+        self._mapped = mapped   # (mmap, its memoryview) when loaded from a file
+        for name, _ in self.SECTIONS:
+            setattr(self, name, arrays[name])
+        self.repo_names = StringTable(self.repo_names_blob, self.repo_names_offsets)
+        self.logins = StringTable(self.logins_blob, self.logins_offsets)
+        self._repo_by_name = None
+
+    @classmethod
+    def build(cls, conn):
+        signature = conn.execute(SIGNATURE_QUERY).fetchone()[0]
+        repos = conn.execute(REPOS_QUERY).fetchall()
+        edges = conn.execute(EDGES_QUERY).fetchall()
+
+        languages = sorted({language for _, _, language in repos if language is not None})
+        language_index = {language: i for i, language in enumerate(languages)}
+        repo_index = {repo_id: i for i, (repo_id, _, _) in enumerate(repos)}
+        logins = sorted({login for login, _, _ in edges})
+        login_index = {login: i for i, login in enumerate(logins)}
+
+        interned = [(login_index[login], repo_index[repo_id], n or 0) for login, repo_id, n in edges]
+        arrays = {
+            'repo_ids': array('q', (repo_id for repo_id, _, _ in repos)),
+            'repo_langs': array('i', (language_index.get(language, -1) for _, _, language in repos)),
+        }
+        arrays['repo_names_blob'], arrays['repo_names_offsets'] = StringTable.pack(name for _, name, _ in repos)
+        arrays['logins_blob'], arrays['logins_offsets'] = StringTable.pack(logins)
+
+        interned.sort()
+        arrays['c_offsets'], arrays['c_repos'], arrays['c_counts'] = csr(interned, len(logins))
+        interned.sort(key=lambda edge: (edge[1], edge[0]))
+        arrays['r_offsets'], arrays['r_contributors'], arrays['r_counts'] = csr(
+            [(r, c, n) for c, r, n in interned], len(repos))
+        return cls(languages, signature, arrays)
+
+    # layout: magic, header length, json header (languages, signature, where each
+    # section starts), then the sections back to back, each 8-byte aligned
+    def save(self, path):
+        sections, layout, offset = [], {}, 0
+        for name, typecode in self.SECTIONS:
+            data = bytes(getattr(self, name)) if typecode == 'B' else getattr(self, name).tobytes()
+            layout[name] = [typecode, offset, len(data)]
+            sections.append(data + b'\0' * (-len(data) % 8))
+            offset += len(sections[-1])
+        header = json.dumps({'languages': self.languages, 'signature': self.signature, 'sections': layout}).encode()
+        header += b' ' * (-(len(header) + 16) % 8)
+
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC + struct.pack('<Q', len(header)) + header)
+            for data in sections:
+                f.write(data)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped[:8] != MAGIC:
+            mapped.close()
+            raise ValueError(f'{path} is not a contributor index')
+        header_length = struct.unpack('<Q', mapped[8:16])[0]
+        header = json.loads(mapped[16:16 + header_length])
+        base = 16 + header_length
+        view = memoryview(mapped)
+        arrays = {
+            name: view[base + offset:base + offset + length].cast(typecode)
+            for name, (typecode, offset, length) in header['sections'].items()
+        }
+        return cls(header['languages'], header['signature'], arrays, (mapped, view))
+
+    # -- lookups
+
+    def login_id(self, login):
+        i = bisect_left(self.logins, login)
+        if i == len(self.logins) or self.logins[i] != login:
+            raise KeyError(f'no contributor {login!r} in the index')
+        return i
+
+    # a repo id, or 'owner/name'
+    def repo_id(self, repo):
+        if isinstance(repo, int) or str(repo).isdigit():
+            i = bisect_left(self.repo_ids, int(repo))
+            if i < len(self.repo_ids) and self.repo_ids[i] == int(repo):
+                return i
+        else:
+            if self._repo_by_name is None:
+                self._repo_by_name = {self.repo_names[i]: i for i in range(len(self.repo_names))}
+            if repo in self._repo_by_name:
+                return self._repo_by_name[repo]
+        raise KeyError(f'no repo {repo!r} in the index')
+
+    def repos_of(self, c):
+        return self.c_repos[self.c_offsets[c]:self.c_offsets[c + 1]]
+
+    def contributors_of(self, r):
+        return self.r_contributors[self.r_offsets[r]:self.r_offsets[r + 1]]
+
+    def language_of(self, r):
+        i = self.repo_langs[r]
+        return self.languages[i] if i >= 0 else None
+
+    # -- queries
+
+    def degree(self, login):
+        c = self.login_id(login)
+        return self.c_offsets[c + 1] - self.c_offsets[c]
+
+    def repo_degree(self, repo):
+        r = self.repo_id(repo)
+        return self.r_offsets[r + 1] - self.r_offsets[r]
+
+    # contributors in the most repos (by='repos') or the most languages
+    def top_span(self, k=TOP_K, by='repos'):
+        offsets = self.c_offsets
+        if by == 'repos':
+            spans = ((offsets[c + 1] - offsets[c], c) for c in range(len(self.logins)))
+        else:
+            langs = self.repo_langs
+            spans = ((len({langs[r] for r in self.repos_of(c)} - {-1}), c) for c in range(len(self.logins)))
+        # logins are sorted, so the lower index wins a tie and ties list alphabetically
+        return [(self.logins[c], span) for span, c in heapq.nlargest(k, spans, key=lambda t: (t[0], -t[1]))]
+
+    # contributors two repos have in common
+    def overlap(self, repo_a, repo_b):
+        a = self.contributors_of(self.repo_id(repo_a))
+        b = self.contributors_of(self.repo_id(repo_b))
+        return [self.logins[c] for c in sorted_intersection(a, b)]
+
+    # who shares the most repos with this contributor
+    def co_contributors(self, login, k=TOP_K):
+        c = self.login_id(login)
+        shared = Counter(other for r in self.repos_of(c) for other in self.contributors_of(r))
+        del shared[c]
+        return [(self.logins[other], n) for other, n in shared.most_common(k)]
+
+    # repos sharing the most contributors with this one
+    def related_repos(self, repo, k=TOP_K):
+        r = self.repo_id(repo)
+        shared = Counter(other for c in self.contributors_of(r) for other in self.repos_of(c))
+        del shared[r]
+        return [(self.repo_names[other], n) for other, n in shared.most_common(k)]
+
+    # biggest contributors to repos in one language, by summed contributions
+    def top_by_language(self, language, k=TOP_K):
+        if language not in self.languages:
+            return []
+        wanted = self.languages.index(language)
+        totals = Counter()
+        for r in range(len(self.repo_ids)):
+            if self.repo_langs[r] == wanted:
+                start, end = self.r_offsets[r], self.r_offsets[r + 1]
+                for c, n in zip(self.r_contributors[start:end], self.r_counts[start:end]):
+                    totals[c] += n
+        return [(self.logins[c], n) for c, n in totals.most_common(k)]
+
+    # the views have to go before the mmap can be closed
+    def close(self):
+        if self._mapped is None:
+            return
+        mapped, view = self._mapped
+        for name, _ in self.SECTIONS:
+            getattr(self, name).release()
+        view.release()
+        mapped.close()
+        self._mapped = None
+
+
+def csr(edges, nodes):
+    offsets = array('q', [0]) * (nodes + 1)
+    targets = array('i', (target for _, target, _ in edges))
+    counts = array('i', (n for _, _, n in edges))
+    for source, _, _ in edges:
+        offsets[source + 1] += 1
+    for i in range(nodes):
+        offsets[i + 1] += offsets[i]
+    return offsets, targets, counts
+
+
+def sorted_intersection(a, b):
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if a[i] == b[j]:
+            yield a[i]
+            i += 1
+            j += 1
+        elif a[i] < b[j]:
+            i += 1
+        else:
+            j += 1
+
+
+def index_path(db_file):
+    return f'{db_file}.contrib_index'
+
+
+# the cached index if it still matches the db, otherwise rebuild and cache it
+def open_index(db_file=DB_FILE, path=None, rebuild=False):
+    path = path or index_path(db_file)
+    conn = sqlite3.connect(db_file)
+    try:
+        signature = conn.execute(SIGNATURE_QUERY).fetchone()[0]
+        if not rebuild and os.path.exists(path):
+            index = ContribIndex.load(path)
+            if index.signature == signature:
+                return index
+            index.close()
+        print(f'building contributor index for {db_file}...')
+        ContribIndex.build(conn).save(path)
+    finally:
+        conn.close()
+    return ContribIndex.load(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='contributor / repo graph queries off a cached CSR index')
+    parser.add_argument('--db', default=DB_FILE)
+    parser.add_argument('--index', help='cache file (default <db>.contrib_index)')
+    parser.add_argument('--rebuild', action='store_true')
+    parser.add_argument('--top', type=int, default=TOP_K)
+    commands = parser.add_subparsers(dest='command', required=True)
+    span = commands.add_parser('span', help='contributors in the most repos or languages')
+    span.add_argument('--by', choices=['repos', 'languages'], default='repos')
+    commands.add_parser('degree', help='how many repos a contributor is in').add_argument('login')
+    commands.add_parser('co', help='who shares the most repos with a contributor').add_argument('login')
+    overlap = commands.add_parser('overlap', help="two repos' shared contributors (id or owner/name)")
+    overlap.add_argument('repo_a')
+    overlap.add_argument('repo_b')
+    commands.add_parser('related', help='repos sharing the most contributors with a repo').add_argument('repo')
+    commands.add_parser('language', help='top contributors to one language').add_argument('language')
+    args = parser.parse_args()
+
+    index = open_index(args.db, args.index, args.rebuild)
+    print(f'{len(index.logins)} contributors, {len(index.repo_ids)} repos, {len(index.c_repos)} edges')
+
+    start = time.perf_counter()
+    try:
+        if args.command == 'span':
+            result = index.top_span(args.top, args.by)
+        elif args.command == 'degree':
+            result = [(args.login, index.degree(args.login))]
+        elif args.command == 'co':
+            result = index.co_contributors(args.login, args.top)
+        elif args.command == 'overlap':
+            result = [(login,) for login in index.overlap(args.repo_a, args.repo_b)]
+        elif args.command == 'related':
+            result = index.related_repos(args.repo, args.top)
+        else:
+            result = index.top_by_language(args.language, args.top)
+    except KeyError as e:
+        raise SystemExit(e.args[0])
+    elapsed = time.perf_counter() - start
+
+    for row in result:
+        print('  '.join(str(value) for value in row))
+    print(f'({elapsed * 1000:.2f} ms)')
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
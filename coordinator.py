@@ -0,0 +1,361 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import http_cache
+import payloads
+from async_crawler import AsyncCrawler
+from forks_and_stars import (
+    BATCH_SECONDS, BATCH_SIZE, BUDGET, CSV_OUTPUT_FILE, LANGUAGES, LOCAL_DB_FILE, NUM_REPOS, SORT_ORDERS,
+    SYNCHRONOUS, BatchWriter, configure_connection, contributor_rows, create_tables, export_to_csv,
+    get_processed_repos, get_tokens, repo_row,
+)
+from rate_limit import RateLimitBudget, print_combined_stats
+from search_shards import SHARD_LIMIT, Shard, plan_shards
+
+LEASE_SECONDS = 600     # a unit nobody has heartbeated for this long goes back in the queue
+MAX_IN_FLIGHT = 4       # per worker
+IDLE_POLL = 5           # how often an idle worker looks for requeued units
+MONITOR_SECONDS = 5
+
+Unit = namedtuple('Unit', 'id language sort_by lo hi total_count quota')
+
+
+# one row per (language, sort_by, star/fork range) to crawl. lo/hi NULL means
+# the plain top-1000 search for that pair. quota is how many new repos the unit
+# may store, its share of --num-repos (NULL for no limit). a worker leases a unit by writing
+# its id and an expiry; the unit only becomes 'done' once the writer process
+# has committed everything the worker sent for it.
+def create_work_queue(cursor):
+    cursor.execute('''
+            CREATE TABLE IF NOT EXISTS work_queue (
+            id INTEGER PRIMARY KEY,
+            language TEXT,
+            sort_by TEXT,
+            lo INTEGER,
+            hi INTEGER,
+            total_count INTEGER,
+            quota INTEGER,
+            state TEXT NOT NULL DEFAULT 'pending',
+            worker TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            done_at TEXT
+            );
+        ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_work_queue_state ON work_queue (state, id)')
+    # queues from before quota: their units fall back to --num-repos
+    cursor.execute('PRAGMA table_info(work_queue)')
+    if 'quota' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute('ALTER TABLE work_queue ADD COLUMN quota INTEGER')
+
+
+def queue_counts(cursor):
+    cursor.execute('SELECT state, COUNT(*) FROM work_queue GROUP BY state')
+    return dict(cursor.fetchall())
+
+
+# single statement, so two workers can never walk off with the same unit
+def claim_unit(conn, worker, lease_seconds=LEASE_SECONDS):
+    row = conn.execute('''
+            UPDATE work_queue SET state = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1
+            WHERE id = (SELECT id FROM work_queue WHERE state = 'pending' ORDER BY id LIMIT 1)
+            RETURNING id, language, sort_by, lo, hi, total_count, quota
+        ''', (worker, time.time() + lease_seconds)).fetchone()
+    conn.commit()
+    return Unit(*row) if row else None
+
+
+def renew_lease(conn, unit_id, worker, lease_seconds=LEASE_SECONDS):
+    conn.execute('''
+            UPDATE work_queue SET lease_expires = ?
+            WHERE id = ? AND worker = ? AND state = 'leased'
+        ''', (time.time() + lease_seconds, unit_id, worker))
+    conn.commit()
+
+
+# only counts if the worker still holds the lease, a unit that expired and got
+# picked up by someone else is theirs to finish
+def finish_unit(cursor, unit_id, worker):
+    cursor.execute('''
+            UPDATE work_queue SET state = 'done', lease_expires = NULL, done_at = datetime('now')
+            WHERE id = ? AND worker = ? AND state = 'leased'
+        ''', (unit_id, worker))
+
+
+# expired leases by default, or every lease of one worker we know is dead,
+# or all of them (whoever held them went down with the last coordinator)
+def requeue(cursor, worker=None, all_leases=False):
+    if all_leases:
+        condition, params = '', ()
+    elif worker is not None:
+        condition, params = 'AND worker = ?', (worker,)
+    else:
+        condition, params = 'AND lease_expires < ?', (time.time(),)
+    cursor.execute(f'''
+            UPDATE work_queue SET state = 'pending', worker = NULL, lease_expires = NULL
+            WHERE state = 'leased' {condition}
+        ''', params)
+    cursor.connection.commit()
+    return cursor.rowcount
+
+
+# sharded: enough star/fork ranges per pair to cover num_repos (see search_shards).
+# pairs are planned side by side, the probes all draw from the one budget
+def plan_units(cursor, languages, sort_orders, num_repos=NUM_REPOS, sharded=True):
+    def plan(language, sort_by):
+        if not sharded:
+            return [(language, sort_by, None, None, None, num_repos)]
+        units, capacity = [], 0
+        for shard in plan_shards(language, sort_by, budget=BUDGET):
+            reachable = min(shard.total_count, SHARD_LIMIT)
+            # the last range only has to make up what the others leave short
+            units.append((language, sort_by, shard.lo, shard.hi, shard.total_count, min(reachable, num_repos - capacity)))
+            capacity += reachable
+            if capacity >= num_repos:
+                break
+        return units
+
+    pairs = [(language, sort_by) for language in languages for sort_by in sort_orders]
+    with ThreadPoolExecutor(max_workers=len(pairs)) as executor:
+        planned = [unit for units in executor.map(lambda pair: plan(*pair), pairs) for unit in units]
+
+    cursor.execute("DELETE FROM work_queue WHERE state = 'done'")
+    cursor.executemany('''
+            INSERT INTO work_queue (language, sort_by, lo, hi, total_count, quota)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', planned)
+    cursor.connection.commit()
+    return len(planned)
+
+
+# stands in for a BatchWriter inside a worker: rows go to the writer process
+class QueueWriter:
+    def __init__(self, results):
+        self.results = results
+
+    def add(self, repo, contributors, language, sort_by):
+        self.results.put(('rows', repo_row(repo), contributor_rows(repo.id, contributors or []), (repo.id, language, sort_by)))
+
+    def flush(self):
+        pass
+
+
+# keeps a unit's lease alive while a worker is busy with it. if the worker dies
+# this dies with it and the lease runs out
+class Heartbeat(threading.Thread):
+    def __init__(self, db, unit_id, worker, lease_seconds):
+        super().__init__(daemon=True)
+        self.db = db
+        self.unit_id = unit_id
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+
+    def run(self):
+        conn = sqlite3.connect(self.db, timeout=30)
+        while not self.stopped.wait(self.lease_seconds / 3):
+            renew_lease(conn, self.unit_id, self.worker, self.lease_seconds)
+        conn.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.join()
+
+
+async def crawl_unit(crawler, unit, num_repos):
+    limit = num_repos if unit.quota is None else unit.quota
+    if unit.lo is None:
+        await crawler.crawl_criteria(unit.language, unit.sort_by, limit)
+        return
+    shard = Shard(unit.sort_by, unit.lo, unit.hi, unit.total_count)
+    processed_repos = get_processed_repos(crawler.cursor, unit.language, unit.sort_by)
+    await crawler.crawl_shard(unit.language, unit.sort_by, shard, processed_repos, {'collected': 0}, limit)
+
+
+def worker_id(pid):
+    return f'worker-{pid}'
+
+
+# each worker gets its own slice of the tokens when there are enough to go round
+def worker_tokens(index, workers, tokens=None):
+    tokens = tokens or get_tokens()
+    if len(tokens) >= workers:
+        return tokens[index::workers]
+    return [tokens[index % len(tokens)]]
+
+
+def worker_main(index, db, results, tokens, lease_seconds, max_in_flight, num_repos, refresh, archive=None):
+    worker = worker_id(os.getpid())
+    # every worker writes its own segments, the pid in their names keeps them apart
+    payloads.open_archive(archive)
+    conn = sqlite3.connect(db, timeout=30)
+    crawler = AsyncCrawler(conn.cursor(), max_in_flight=max_in_flight, budget=RateLimitBudget(tokens),
+                           writer=QueueWriter(results), refresh=refresh)
+    try:
+        while True:
+            unit = claim_unit(conn, worker, lease_seconds)
+            if unit is None:
+                # others may still drop a unit (killed worker, expired lease)
+                if queue_counts(conn.cursor()).get('leased'):
+                    time.sleep(IDLE_POLL)
+                    continue
+                break
+            print(f'{worker} took unit {unit.id}: {unit.language} {unit.sort_by} {unit.lo}..{unit.hi}')
+            with Heartbeat(db, unit.id, worker, lease_seconds):
+                asyncio.run(crawl_unit(crawler, unit, num_repos))
+            results.put(('done', unit.id, worker))
+    finally:
+        # each worker keeps its own budget, the writer prints them as one table
+        results.put(('budget', crawler.budget.counts()))
+        crawler.close()
+        conn.close()
+        payloads.close_archive()
+
+
+# the only process that writes crawl results
+def writer_main(db, results, batch_size, batch_seconds, synchronous):
+    conn = sqlite3.connect(db, timeout=30)
+    configure_connection(conn, synchronous)
+    cursor = conn.cursor()
+    writer = BatchWriter(cursor, batch_size=batch_size, max_wait=batch_seconds)
+    budgets = []
+    try:
+        while True:
+            try:
+                message = results.get(timeout=1)
+            except queue.Empty:
+                writer.maybe_flush()
+                continue
+            if message is None:
+                break
+            kind, *payload = message
+            if kind == 'rows':
+                writer.add_rows(*payload)
+            elif kind == 'done':
+                # everything that worker sent for the unit came before this
+                writer.flush()
+                finish_unit(cursor, *payload)
+                conn.commit()
+            elif kind == 'budget':
+                budgets.append(payload[0])
+    finally:
+        writer.flush()
+        cursor.close()
+        conn.close()
+    if budgets:
+        print_combined_stats(budgets)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='crawl with several worker processes off a shared work queue')
+    parser.add_argument('--db', default=LOCAL_DB_FILE)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--languages', nargs='+', default=LANGUAGES)
+    parser.add_argument('--sort-orders', nargs='+', default=SORT_ORDERS, choices=SORT_ORDERS)
+    parser.add_argument('--num-repos', type=int, default=NUM_REPOS, help='per language/sort pair')
+    parser.add_argument('--no-shard', action='store_true', help='one top-1000 unit per pair instead of star/fork ranges')
+    parser.add_argument('--lease-seconds', type=float, default=LEASE_SECONDS)
+    parser.add_argument('--max-in-flight', type=int, default=MAX_IN_FLIGHT, help='concurrent requests per worker')
+    parser.add_argument('--refresh', action='store_true',
+                        help='also re-crawl already processed repos whose stars/forks/updated_at changed')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--batch-seconds', type=float, default=BATCH_SECONDS)
+    parser.add_argument('--synchronous', default=SYNCHRONOUS, choices=['OFF', 'NORMAL', 'FULL'])
+    parser.add_argument('--archive', metavar='DIR',
+                        help='workers also log every raw api response to gzipped segments here (see replay.py)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    started = time.time()
+
+    conn = sqlite3.connect(args.db, timeout=30)
+    configure_connection(conn, args.synchronous)
+    cursor = conn.cursor()
+    create_tables(cursor)
+    create_work_queue(cursor)
+    conn.commit()
+
+    # anything left unfinished means the last run died, pick it up instead of replanning
+    counts = queue_counts(cursor)
+    if counts.get('pending') or counts.get('leased'):
+        requeue(cursor, all_leases=True)
+        print(f"resuming {counts.get('pending', 0) + counts.get('leased', 0)} unfinished units")
+    else:
+        planned = plan_units(cursor, args.languages, args.sort_orders, args.num_repos, sharded=not args.no_shard)
+        print(f'planned {planned} units for {len(args.languages)} languages')
+        http_cache.print_stats()
+
+    # spawn, not fork: the children open their own sqlite / http connections
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue(maxsize=10_000)
+    writer = context.Process(target=writer_main, name='writer',
+                             args=(args.db, results, args.batch_size, args.batch_seconds, args.synchronous))
+    writer.start()
+
+    def spawn(index):
+        process = context.Process(target=worker_main, name=f'worker-{index}', args=(
+            index, args.db, results, worker_tokens(index, args.workers), args.lease_seconds,
+            args.max_in_flight, args.num_repos, args.refresh, args.archive,
+        ))
+        process.start()
+        return process
+
+    workers = {index: spawn(index) for index in range(args.workers)}
+    restarts = 0
+    try:
+        while any(process.is_alive() for process in workers.values()):
+            time.sleep(MONITOR_SECONDS)
+            expired = requeue(cursor)
+            if expired:
+                print(f'{expired} expired leases back in the queue')
+            for index, process in list(workers.items()):
+                if process.is_alive() or process.exitcode == 0:
+                    continue
+                # killed or crashed: its units go straight back, and someone takes its place
+                dropped = requeue(cursor, worker=worker_id(process.pid))
+                print(f'{process.name} exited with {process.exitcode}, requeued {dropped} units')
+                workers[index] = None
+                counts = queue_counts(cursor)
+                if counts.get('pending') and restarts < 3 * args.workers:
+                    restarts += 1
+                    workers[index] = spawn(index)
+            workers = {index: process for index, process in workers.items() if process is not None}
+            counts = queue_counts(cursor)
+            print(f"units: {counts.get('done', 0)} done, {counts.get('leased', 0)} leased, {counts.get('pending', 0)} pending")
+    except KeyboardInterrupt:
+        print('\n keyboard interruption, stopping workers')
+        for process in workers.values():
+            process.terminate()
+    finally:
+        for process in workers.values():
+            process.join()
+        results.put(None)
+        writer.join()
+
+    try:
+        counts = queue_counts(cursor)
+        print(f"{counts.get('done', 0)} units done, {counts.get('pending', 0) + counts.get('leased', 0)} left for the next run "
+              f'({time.time() - started:.1f}s, {restarts} worker restarts)')
+        export_to_csv(cursor, CSV_OUTPUT_FILE)
+        print(f'CSV exported to {CSV_OUTPUT_FILE}')
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
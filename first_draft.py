@@ -1,46 +1,137 @@
-import requests
+import argparse
 import os
+import sqlite3
+
+import http_cache
+from retry import RetryPolicy
 
 GITHUB_TOKEN = os.getenv('GITHUB_TOKEN')
+GRAPHQL_URL = os.environ.get('GITHUB_GRAPHQL_URL', 'https://api.github.com/graphql')
+DB_FILE = 'github_repos.db'
+PROFILE_BATCH_SIZE = 100
+PROFILE_TTL_DAYS = 7
+RETRY = RetryPolicy('github_graphql')
+
+# found = 0 means github had no such user (bots, renamed/deleted accounts),
+# kept so we don't keep asking until the ttl runs out
+def create_profiles_table(cursor):
+    cursor.execute('''
+            CREATE TABLE IF NOT EXISTS profiles (
+            login TEXT PRIMARY KEY,
+            name TEXT,
+            email TEXT,
+            blog TEXT,
+            company TEXT,
+            location TEXT,
+            found INTEGER,
+            fetched_at TEXT
+            );
+        ''')
+
+# contributors we've never looked up, or looked up more than ttl_days ago
+def stale_logins(cursor, ttl_days=PROFILE_TTL_DAYS):
+    cursor.execute('''
+            SELECT DISTINCT c.contributor FROM contributors c
+            LEFT JOIN profiles p ON p.login = c.contributor
+            WHERE c.contributor IS NOT NULL
+            AND (p.login IS NULL OR p.fetched_at < datetime('now', ?))
+        ''', (f'-{ttl_days} days',))
+    return [row[0] for row in cursor.fetchall()]
+
+# one graphql query for up to ~100 logins, each one an aliased user() lookup.
+# logins github can't resolve come back as null plus a NOT_FOUND entry in
+# 'errors'. any other error (RATE_LIMITED, a timeout, ...) arrives as a 200 too,
+# often with data null; then the batch isn't ours to judge and we return None
+def fetch_profiles(logins):
+    params = ', '.join(f'$l{i}: String!' for i in range(len(logins)))
+    fields = ' '.join(
+        f'u{i}: user(login: $l{i}) {{ login name email websiteUrl company location }}'
+        for i in range(len(logins))
+    )
+    payload = {
+        'query': f'query({params}) {{ {fields} }}',
+        'variables': {f'l{i}': login for i, login in enumerate(logins)},
+    }
+    response = RETRY.call(
+        lambda: http_cache.get_session().post(GRAPHQL_URL, json=payload, headers={'Authorization': f'bearer {GITHUB_TOKEN}'}),
+        describe=f'profiles for {len(logins)} logins',
+    )
+    if response is None:
+        return None
+    body = response.json()
+    data = body.get('data')
+    errors = body.get('errors') or []
+    other = [e for e in errors if e.get('type') != 'NOT_FOUND' or not e.get('path')]
+    if data is None or other:
+        message = other[0].get('message') if other else 'no data'
+        print(f'graphql error for {len(logins)} logins, leaving them for the next run: {message}')
+        return None
+    missing = {e['path'][0] for e in errors}
+    # a null without a NOT_FOUND isn't a missing user, leave that login stale
+    return {
+        login: data.get(f'u{i}') for i, login in enumerate(logins)
+        if data.get(f'u{i}') or f'u{i}' in missing
+    }
+
+def store_profiles(cursor, profiles):
+    cursor.executemany('''
+            INSERT OR REPLACE INTO profiles (login, name, email, blog, company, location, found, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'))
+        ''', [
+        (login, p.get('name'), p.get('email') or None, p.get('websiteUrl'), p.get('company'), p.get('location'), 1)
+        if p else (login, None, None, None, None, None, 0)
+        for login, p in profiles.items()
+    ])
 
-headers = {
-    'Authorization': f'token {GITHUB_TOKEN}',
-    'Accept': 'application/vnd.github.v3+json',
-}
-
-def get_repo_contributors(repo_owner, repo_name):
-    url = f'https://api.github.com/repos/{repo_owner}/{repo_name}/contributors'
-    response = requests.get(url, headers=headers)
-    return response.json() if response.status_code == 200 else []
-
-def get_user_profile(username):
-    url = f'https://api.github.com/users/{username}'
-    response = requests.get(url, headers=headers)
-    return response.json() if response.status_code == 200 else None
-
-def main():
-    repos = [
-        ('DayByDayBy', 'leaky_windows'),
-    ]
-    
-        
-    
-    
-    
-    for owner, repo in repos:
-        print(f"Fetching contributors for {owner}/{repo}")
-        contributors = get_repo_contributors(owner, repo)
-        
-        for contributor in contributors:
-            username = contributor['login']
-            profile = get_user_profile(username)
-            
-            if profile and profile.get('email'):
-                print(f"User: {username}, Email: {profile['email']}")
-            elif profile and profile.get('blog'):
-                print(f"User: {username}, Website: {profile['blog']}")
+def enrich_profiles(cursor, batch_size=PROFILE_BATCH_SIZE, ttl_days=PROFILE_TTL_DAYS):
+    # the contributors come from a crawl, without one there's nobody to look up
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'contributors'")
+    if cursor.fetchone() is None:
+        db = cursor.connection.execute('PRAGMA database_list').fetchone()[2]
+        raise SystemExit(f'no contributors table in {db or "the db"}, run a crawl first (gitgrab crawl)')
+    create_profiles_table(cursor)
+    logins = stale_logins(cursor, ttl_days)
+    print(f'{len(logins)} contributor profiles missing or older than {ttl_days} days')
+
+    for i in range(0, len(logins), batch_size):
+        batch = logins[i:i+batch_size]
+        profiles = fetch_profiles(batch)
+        if profiles is None:
+            # leave them stale, the next run picks them up again
+            continue
+        store_profiles(cursor, profiles)
+        cursor.connection.commit()
+        print(f'fetched profiles {i + len(batch)}/{len(logins)}')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='look up public contact info for every stored contributor')
+    parser.add_argument('--db', default=DB_FILE)
+    parser.add_argument('--batch-size', type=int, default=PROFILE_BATCH_SIZE)
+    parser.add_argument('--ttl-days', type=float, default=PROFILE_TTL_DAYS)
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    cursor = conn.cursor()
+    try:
+        enrich_profiles(cursor, args.batch_size, args.ttl_days)
+
+        cursor.execute('''
+                SELECT login, email, blog FROM profiles
+                WHERE login IN (SELECT contributor FROM contributors)
+                ORDER BY login
+            ''')
+        for username, email, blog in cursor.fetchall():
+            if email:
+                print(f"User: {username}, Email: {email}")
+            elif blog:
+                print(f"User: {username}, Website: {blog}")
             else:
                 print(f"User: {username}, No public contact info available")
+    finally:
+        cursor.close()
+        conn.close()
+
+    http_cache.print_stats()
 
 if __name__ == "__main__":
     main()
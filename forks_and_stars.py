@@ -1,23 +1,74 @@
-import requests
 import time
 import sqlite3
 import csv
 from datetime import datetime
 import json 
 import os
+import argparse
+import threading
+from contextlib import nullcontext
+from functools import partial
+from urllib.parse import quote
+
+import http_cache
+import metrics
+import payloads
+from pipeline import Pipeline, Stage
+from rate_limit import RateLimitBudget
+from retry import RetryPolicy
 
 TIME_STAMP = datetime.now().strftime("%Y%m%d_%H%M")
 
 NUM_REPOS = 50
 NUM_CONTRIBUTORS = 5
-with open('config.json') as f:
-    config = json.load(f)
-api_key = config['GITHUB_TOKEN']
-HEADERS = {"Authorization": f"token {api_key}"}
+CONFIG_FILE = 'config.json'
 LANGUAGES = ["C++", "C#", "C"]
+SORT_ORDERS = ["forks", "stars"]
+API_BASE = os.environ.get('GITHUB_API_BASE', 'https://api.github.com')
 LOCAL_DB_FILE = 'github_repos.db'
 CSV_OUTPUT_FILE = f'{TIME_STAMP}_github_repos.csv'
 MAX_RETRIES = 5
+BATCH_SIZE = 50         # repos per write transaction
+BATCH_SECONDS = 10      # or flush whatever is buffered after this long
+SYNCHRONOUS = 'NORMAL'  # fine with WAL, a crash can only lose the last batch
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_COLUMNS = ['id', 'name', 'url', 'stars', 'forks', 'language', 'owner', 'created_at', 'updated_at']
+PER_PAGE = 100
+MAX_SEARCH_PAGE = 10        # search stops at 1000 results
+SEARCH_WORKERS = 2          # language/sort pairs paging through search at once
+RECORD_WORKERS = 1          # decoding is cpu bound, more threads just fight over the gil
+CONTRIBUTOR_WORKERS = 8     # contributor requests in flight
+QUEUE_SIZE = 64             # items waiting in front of each stage
+REPORT_SECONDS = 10         # how often the crawl prints queue depths and rates, 0 for never
+
+_config = None
+
+# config.json is read the first time a request needs a token, so exports,
+# migrations and --help work without credentials
+def get_config():
+    global _config
+    if _config is None:
+        with open(CONFIG_FILE) as f:
+            _config = json.load(f)
+    return _config
+
+# GITHUB_TOKENS (a list) spreads requests over several tokens, GITHUB_TOKEN still works
+def get_tokens():
+    config = get_config()
+    return config.get('GITHUB_TOKENS') or [config['GITHUB_TOKEN']]
+
+def auth_headers():
+    return {"Authorization": f"token {get_tokens()[0]}"}
+
+# every request picks the token with the most quota left, see rate_limit.py
+BUDGET = RateLimitBudget(get_tokens)
+# backoff, Retry-After and a circuit breaker for every github call, see retry.py
+RETRY = RetryPolicy('github', max_attempts=MAX_RETRIES)
+
+# WAL so readers don't block the writer, and no fsync on every commit
+def configure_connection(conn, synchronous=SYNCHRONOUS):
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f'PRAGMA synchronous={synchronous}')
 
 # create tables (if they don't exist)
 def create_tables(cursor):
@@ -31,9 +82,11 @@ def create_tables(cursor):
             language TEXT,
             owner TEXT,
             created_at TEXT,
-            updated_at TEXT
+            updated_at TEXT,
+            synced_at TEXT
         );
         ''')
+    migrate_repositories(cursor)
     cursor.execute('''
             CREATE TABLE IF NOT EXISTS contributors (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -50,13 +103,125 @@ def create_tables(cursor):
             sort_by TEXT
             );
         ''')
+    cursor.execute('''
+            CREATE TABLE IF NOT EXISTS export_state (
+            name TEXT PRIMARY KEY,
+            watermark TEXT
+            );
+        ''')
+    create_history(cursor)
+    migrate_contributors(cursor)
+    # the unique (repo_id, contributor) index also covers lookups by repo_id alone
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_contributors_contributor ON contributors (contributor)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_processed_repos_criteria ON processed_repos (language, sort_by)')
 
-def insert_processed_repo(cursor, repo_id, language, sort_by):
+# synced_at is when we last wrote a changed row, it's what incremental exports key on.
+# rows from before the column existed stay NULL and only show up in full exports.
+def migrate_repositories(cursor):
+    cursor.execute('PRAGMA table_info(repositories)')
+    if 'synced_at' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute('ALTER TABLE repositories ADD COLUMN synced_at TEXT')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_repositories_synced_at ON repositories (synced_at)')
+
+# star/fork counts over time, one row per repo per observed change. the triggers
+# fire on every write path, and since unchanged repos are never rewritten (see
+# insert_repos) a row here always means the numbers moved.
+def create_history(cursor):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'repo_history'")
+    backfill = cursor.fetchone() is None
     cursor.execute('''
-                INSERT OR REPLACE INTO processed_repos (id, language, sort_by)
-                VALUES (?,?,?)
-            ''', (repo_id, language, sort_by))    
+            CREATE TABLE IF NOT EXISTS repo_history (
+            repo_id INTEGER NOT NULL,
+            observed_at TEXT NOT NULL,
+            stars INTEGER,
+            forks INTEGER,
+            PRIMARY KEY (repo_id, observed_at)
+            ) WITHOUT ROWID;
+        ''')
+    cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS repo_history_insert AFTER INSERT ON repositories
+            BEGIN
+                INSERT OR REPLACE INTO repo_history (repo_id, observed_at, stars, forks)
+                VALUES (new.id, COALESCE(new.synced_at, strftime('%Y-%m-%dT%H:%M:%f', 'now')), new.stars, new.forks);
+            END;
+        ''')
+    cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS repo_history_update AFTER UPDATE OF stars, forks ON repositories
+            WHEN old.stars IS NOT new.stars OR old.forks IS NOT new.forks
+            BEGIN
+                INSERT OR REPLACE INTO repo_history (repo_id, observed_at, stars, forks)
+                VALUES (new.id, COALESCE(new.synced_at, strftime('%Y-%m-%dT%H:%M:%f', 'now')), new.stars, new.forks);
+            END;
+        ''')
+    if backfill:
+        # repos already in the db get their current numbers as a starting point
+        cursor.execute('''
+                INSERT OR IGNORE INTO repo_history (repo_id, observed_at, stars, forks)
+                SELECT id, COALESCE(synced_at, updated_at, ''), stars, forks FROM repositories
+            ''')
+
+# older dbs let every re-crawl append the same contributors again (the autoincrement
+# id meant INSERT OR REPLACE never had anything to replace). collapse those down to
+# the first row per (repo_id, contributor), carrying over the newest contribution
+# count, then add the unique key so upserts have something to conflict on.
+def migrate_contributors(cursor):
+    cursor.execute('''
+            SELECT 1 FROM sqlite_master
+            WHERE type = 'index' AND name = 'idx_contributors_repo_contributor'
+        ''')
+    if cursor.fetchone():
+        return
+    cursor.execute('''
+            UPDATE contributors SET contributions = (
+                SELECT newest.contributions FROM contributors newest
+                WHERE newest.repo_id = contributors.repo_id AND newest.contributor = contributors.contributor
+                ORDER BY newest.id DESC LIMIT 1
+            )
+            WHERE id IN (
+                SELECT MIN(id) FROM contributors
+                GROUP BY repo_id, contributor HAVING COUNT(*) > 1
+            )
+        ''')
+    cursor.execute('''
+            DELETE FROM contributors WHERE id NOT IN (
+                SELECT MIN(id) FROM contributors GROUP BY repo_id, contributor
+            )
+        ''')
+    if cursor.rowcount:
+        print(f'removed {cursor.rowcount} duplicate contributor rows')
+    cursor.execute('''
+            CREATE UNIQUE INDEX idx_contributors_repo_contributor
+            ON contributors (repo_id, contributor)
+        ''')
+
+def insert_processed_repo(cursor, repo_id, language, sort_by):
+    insert_processed_rows(cursor, [(repo_id, language, sort_by)])
     
+# what we last stored for these repos, for refresh mode to compare search hits against
+def get_repo_states(cursor, repo_ids):
+    repo_ids = list(repo_ids)
+    if not repo_ids:
+        return {}
+    cursor.execute(f'''
+                SELECT id, updated_at, stars, forks FROM repositories
+                WHERE id IN ({','.join('?' * len(repo_ids))})
+            ''', repo_ids)
+    return {row[0]: row[1:] for row in cursor.fetchall()}
+
+def get_all_repo_states(cursor):
+    cursor.execute('SELECT id, updated_at, stars, forks FROM repositories')
+    return {row[0]: row[1:] for row in cursor.fetchall()}
+
+def repo_changed(state, repo):
+    return state != (repo.updated_at, repo.stars, repo.forks)
+
+# new repos always get fetched. in refresh mode, so do already processed ones
+# whose search hit no longer matches what we stored
+def needs_fetch(repo, processed_repos, states=None):
+    if repo.id not in processed_repos:
+        return True
+    return states is not None and repo_changed(states.get(repo.id), repo)
+
 def get_processed_repos(cursor, language, sort_by):
     cursor.execute('''
                 SELECT id FROM processed_repos
@@ -66,154 +231,385 @@ def get_processed_repos(cursor, language, sort_by):
     
     
     
-def api_call_and_retry(url, headers, max_retries=MAX_RETRIES):
+# parse turns the raw body into whatever the caller keeps, e.g. payloads.repo_page
+def api_call_and_retry(url, headers, max_retries=MAX_RETRIES, budget=None, policy=None, parse=payloads.loads):
+    policy = policy or RETRY
 
-    try:
-        for attempt in range(max_retries):
-            
-            response = requests.get(url, headers=headers)
-            
-            if response.status_code == 200:
-                return response.json()
-            
-            if response.status_code == 403:
-                if 'X-RateLimit-Reset' in response.headers:
-                    reset_time = int(response.headers['X-RateLimit-Reset'])
-                    current_time = int(time.time())
-                    sleep_time = max((reset_time -  current_time), 0)
-                    if sleep_time > 0:
-                        sleep_minutes = sleep_time / 60
-                        print(f'rate limited, bro. sleeping it off for {sleep_minutes:.2f} minutes')
-                        time.sleep(sleep_time)
-                        continue
-                else:
-                    print('403 forbidden received without rate limit info. retrying with backoff.')
-                    
-            print(f'Error: {response.status_code}: {response.text}')
-            
-    except requests.exceptions.RequestException as e:
-        print(f'request failure: {e}')
-            
+    def send():
+        # budget is the shared rate limit bucket, it also picks which token to send
+        with (budget.slot(url) if budget else nullcontext()) as slot:
+            with metrics.timer('github.http'):
+                response = http_cache.cached_get(url, {**headers, **slot.auth} if slot else headers)
+            if slot:
+                slot.observe(response.headers)
+        metrics.count('github_responses', status=response.status_code)
+        return response
 
-        backoff = 2 ** (max_retries - attempt)
-        retries_left = max_retries - (attempt + 1)
-        print(f'Retrying in {backoff} seconds... ({retries_left} retries left)')
-        time.sleep(backoff)
-            
-           
-    print('retries exhausted. script exit.')
-    return None
+    # with a budget a spent token is its problem: it routes the retry to another
+    # token, or waits for the reset itself
+    response = policy.call(send, max_attempts=max_retries, wait_on_rate_limit=budget is None, describe=url)
+    if response is None:
+        return None
+    payloads.archive(url, response.content)
+    with metrics.timer('github.json_decode'):
+        return parse(response.content)
     
     
     
 # fetch repos:
-def fetch_repos(language, sort_by="stars", per_page=100, page=1):
-    url = f"https://api.github.com/search/repositories?q=stars:>1+language:{language}&sort={sort_by}&order=desc&per_page={per_page}&page={page}"
-    response = api_call_and_retry(url, HEADERS)
-    return response.get('items', []) if response else []
+# qualifiers narrows the search, e.g. 'stars:1000..5000' for one shard
+def search_url(language, sort_by, per_page, page, qualifiers):
+    return f"{API_BASE}/search/repositories?q={qualifiers}+language:{quote(language)}&sort={sort_by}&order=desc&per_page={per_page}&page={page}"
+
+# the raw search response, for when total_count matters (see search_shards.py)
+def search_repos(language, sort_by="stars", per_page=100, page=1, budget=BUDGET, qualifiers='stars:>1'):
+    return api_call_and_retry(search_url(language, sort_by, per_page, page, qualifiers), auth_headers(), budget=budget)
+
+# just the hits, as RepoRecords
+def fetch_repos(language, sort_by="stars", per_page=100, page=1, budget=BUDGET, qualifiers='stars:>1'):
+    url = search_url(language, sort_by, per_page, page, qualifiers)
+    return api_call_and_retry(url, auth_headers(), budget=budget, parse=payloads.repo_page) or []
 
 
 # fetch contributors for a repo:
-def fetch_contributors(owner, repo, limit):
-    url = f"https://api.github.com/repos/{owner}/{repo}/contributors?per_page={limit}"
-    response = api_call_and_retry(url, HEADERS)
-    return response[:limit] if response else []
+def fetch_contributors(owner, repo, limit, budget=BUDGET):
+    url = f"{API_BASE}/repos/{owner}/{repo}/contributors?per_page={limit}"
+    return api_call_and_retry(url, auth_headers(), budget=budget, parse=partial(payloads.contributor_page, limit=limit)) or []
             
 
 # insert repositories into db
+# synced_at=None stamps the row with the time it's written; replay.py passes
+# when the response was fetched instead, so repo_history keeps the real dates
+def repo_row(repo_data, synced_at=None):
+    return (*repo_data.row(), synced_at)
+
 def insert_repo(cursor, repo_data):
-    cursor.execute('''
-            INSERT OR REPLACE INTO repositories (id, name, url, stars, forks, language, owner, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-        repo_data['id'], repo_data['name'], repo_data['html_url'], repo_data['stargazers_count'],
-        repo_data['forks_count'], repo_data['language'], repo_data['owner']['login'],
-        repo_data['created_at'], repo_data['updated_at']
-    ))
+    insert_repos(cursor, [repo_row(repo_data)])
+
+# re-crawling an unchanged repo leaves the row (and its synced_at) alone
+@metrics.timed('db.insert_repos')
+def insert_repos(cursor, rows):
+    cursor.executemany('''
+            INSERT INTO repositories (id, name, url, stars, forks, language, owner, created_at, updated_at, synced_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, strftime('%Y-%m-%dT%H:%M:%f', 'now')))
+            ON CONFLICT (id) DO UPDATE SET
+                name = excluded.name, url = excluded.url, stars = excluded.stars, forks = excluded.forks,
+                language = excluded.language, owner = excluded.owner, created_at = excluded.created_at,
+                updated_at = excluded.updated_at, synced_at = excluded.synced_at
+            WHERE name IS NOT excluded.name OR url IS NOT excluded.url OR stars IS NOT excluded.stars
+                OR forks IS NOT excluded.forks OR language IS NOT excluded.language
+                OR owner IS NOT excluded.owner OR created_at IS NOT excluded.created_at
+                OR updated_at IS NOT excluded.updated_at
+        ''', rows)
+    # rowcount only counts rows that actually changed
+    metrics.count('db_rows', max(cursor.rowcount, 0), table='repositories')
 
 # send contributors into db
 
+def contributor_rows(repo_id, contributors):
+    return [(repo_id, contributor.login, contributor.contributions) for contributor in contributors]
+
 def insert_contributors(cursor, repo_id, contributors):
+    insert_contributor_rows(cursor, contributor_rows(repo_id, contributors))
+
+@metrics.timed('db.insert_contributors')
+def insert_contributor_rows(cursor, rows):
+    cursor.executemany('''
+        INSERT INTO contributors (repo_id, contributor, contributions)
+        VALUES (?, ?, ?)
+        ON CONFLICT (repo_id, contributor) DO UPDATE SET contributions = excluded.contributions;
+    ''', rows)
+    metrics.count('db_rows', max(cursor.rowcount, 0), table='contributors')
+
+@metrics.timed('db.insert_processed')
+def insert_processed_rows(cursor, rows):
     cursor.executemany('''
-        INSERT OR REPLACE INTO contributors (repo_id, contributor, contributions)
-        VALUES (?, ?, ?);
-    ''', [(repo_id, contributor['login'], contributor['contributions']) for contributor in contributors])
+                INSERT OR REPLACE INTO processed_repos (id, language, sort_by)
+                VALUES (?,?,?)
+            ''', rows)
+    metrics.count('db_rows', max(cursor.rowcount, 0), table='processed_repos')
+
+
+# write-behind buffer for parsed repos. rows pile up until there are batch_size
+# repos or max_wait seconds have passed, then go in as one transaction. the
+# processed_repos rows ride in the same transaction, so a repo only counts as
+# processed once its batch has committed and a crash just re-crawls the tail.
+class BatchWriter:
+    def __init__(self, cursor, batch_size=BATCH_SIZE, max_wait=BATCH_SECONDS):
+        self.cursor = cursor
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.pending = []
+        self.started = None
+        self.committed = 0
+
+    def add(self, repo, contributors, language, sort_by):
+        self.add_rows(repo_row(repo), contributor_rows(repo.id, contributors or []), (repo.id, language, sort_by))
+
+    # same thing for rows built elsewhere, e.g. sent over from a crawl worker process
+    def add_rows(self, repo, contributors, processed):
+        if not self.pending:
+            self.started = time.monotonic()
+        self.pending.append((repo, contributors, processed))
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.pending and time.monotonic() - self.started >= self.max_wait:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        try:
+            self._write(batch)
+        except sqlite3.Error as e:
+            # one bad row shouldn't sink the whole batch, redo it a repo at a time
+            print(f'error writing batch of {len(batch)} repos: {e}. retrying one by one')
+            self.cursor.connection.rollback()
+            for entry in batch:
+                try:
+                    self._write([entry])
+                except sqlite3.Error as e:
+                    print(f'error processing repo {entry[0][1]}: {e}')
+                    self.cursor.connection.rollback()
+
+    def _write(self, batch):
+        insert_repos(self.cursor, [repo for repo, _, _ in batch])
+        insert_contributor_rows(self.cursor, [row for _, rows, _ in batch for row in rows])
+        insert_processed_rows(self.cursor, [processed for _, _, processed in batch])
+        with metrics.timer('db.commit'):
+            self.cursor.connection.commit()
+        self.committed += len(batch)
+        print(f'committed batch of {len(batch)} repos ({self.committed} this run)')
+
+
+# one language/sort pair on its way through the crawl pipeline. the search stage
+# keeps paging until the records stage has seen the last page (or enough repos)
+class CrawlPair:
+    def __init__(self, language, sort_by, processed, sharded=False):
+        self.language = language
+        self.sort_by = sort_by
+        self.processed = processed  # repo ids already crawled for this pair
+        self.sharded = sharded      # a short page only ends a shard, not the pair
+        self.seen = set()
+        self.collected = 0
+        self.done = False
+        self.lock = threading.Lock()
 
 
 # grabbing starred/forked repos:
-def fetch_and_store_repos_by_criteria(cursor, language, sort_by, num_repos=NUM_REPOS):
-    per_page = 100
-    collected_repos = 0
-    page = 1
-    processed_repos = get_processed_repos(cursor, language, sort_by)
-    
-    while collected_repos < num_repos:
-        repos = fetch_repos(
-            language,
-            sort_by=sort_by, 
-            per_page=per_page, 
-            page=page)
-        
-        if not repos:
-            print("no more repos")
+# search pages -> repo records -> contributors -> db, each stage on its own
+# threads behind a bounded queue (see pipeline.py), so contributor requests keep
+# going while sqlite commits and a slow stage holds the ones before it back
+# instead of piling up. sqlite is only touched from this thread: processed ids
+# (and stored states, for refresh) are read up front and the writer stage runs here.
+# num_repos=None takes everything search hands back: up to its 1000 cap, or with
+# sharded=True every star/fork range search_shards plans, so well past it.
+def crawl_pipeline(cursor, languages=LANGUAGES, sort_orders=SORT_ORDERS, num_repos=None, writer=None,
+                   refresh=False, search_workers=SEARCH_WORKERS, record_workers=RECORD_WORKERS,
+                   contributor_workers=CONTRIBUTOR_WORKERS, queue_size=QUEUE_SIZE,
+                   report_every=REPORT_SECONDS, budget=BUDGET, sharded=False):
+    writer = writer or BatchWriter(cursor)
+    states = get_all_repo_states(cursor) if refresh else None
+    pairs = [CrawlPair(language, sort_by, get_processed_repos(cursor, language, sort_by), sharded)
+             for language in languages for sort_by in sort_orders]
+
+    # False once the pair has had enough or search stopped answering
+    def search_range(pair, emit, pages, qualifiers):
+        for page in range(1, pages + 1):
+            if pair.done:
+                return False
+            url = search_url(pair.language, pair.sort_by, PER_PAGE, page, qualifiers)
+            # just the body, decoding is the next stage's job
+            content = api_call_and_retry(url, auth_headers(), budget=budget, parse=bytes)
+            if content is None:
+                return False
+            emit((pair, content))
+        return True
+
+    def search_pages(pair, emit):
+        if not sharded:
+            print(f'grabbing high {pair.sort_by} repos with {pair.language}...')
+            search_range(pair, emit, MAX_SEARCH_PAGE, 'stars:>1')
+            return
+        # search_shards imports this module, so it's only loaded for sharded crawls
+        from search_shards import plan_shards
+        print(f'grabbing high {pair.sort_by} repos with {pair.language} (sharded)...')
+        for shard in plan_shards(pair.language, pair.sort_by, budget=budget):
+            if not search_range(pair, emit, shard.pages, shard.qualifiers):
+                break
+
+    def page_records(item, emit):
+        pair, content = item
+        with metrics.timer('github.json_decode'):
+            repos = payloads.repo_page(content)
+        fresh = []
+        with pair.lock:
+            if len(repos) < PER_PAGE and not pair.sharded:
+                pair.done = True
+                if not repos:
+                    print(f'no more repos ({pair.language}, {pair.sort_by})')
+            for repo in repos:
+                if num_repos is not None and pair.collected >= num_repos:
+                    pair.done = True
+                    break
+                if repo.id in pair.seen:
+                    continue
+                pair.seen.add(repo.id)
+                if not needs_fetch(repo, pair.processed, states):
+                    print(f"skipping {'unchanged' if refresh else 'prev inserted'} repo: {repo.name}")
+                    continue
+                pair.collected += 1
+                fresh.append(repo)
+        for repo in fresh:
+            emit((pair, repo))
+
+    def repo_contributors(item, emit):
+        pair, repo = item
+        try:
+            contributors = fetch_contributors(repo.owner, repo.name, NUM_CONTRIBUTORS, budget=budget)
+        except Exception as e:
+            print(f"error processing repo {repo.name}: {e}")
+            return
+        emit((pair, repo, contributors))
+
+    def store(item, emit):
+        pair, repo, contributors = item
+        writer.add(repo, contributors, pair.language, pair.sort_by)
+        print(f"buffered repo: {repo.name}")
+
+    Pipeline([
+        Stage('search', search_pages, search_workers, queue_size),
+        # a page is ~100 repos of raw json, only keep a couple per searcher waiting
+        Stage('records', page_records, record_workers, max(2, search_workers * 2)),
+        Stage('contributors', repo_contributors, contributor_workers, queue_size),
+        Stage('writer', store, 1, queue_size, on_idle=writer.maybe_flush, on_done=writer.flush),
+    ], name='crawl', report_every=report_every).run(pairs)
+    return sum(pair.collected for pair in pairs)
 
-            break
-        
-        for repo in repos:
-            if repo['id'] in processed_repos:
-                print(f"skipping prev inserted repo: {repo['name']}")
-                continue
-            
-            try:
-                insert_repo(cursor, repo)
-                print(f"inserted repo: {repo['name']}")       
-                     
-                contributors = fetch_contributors(repo['owner']['login'], repo['name'], NUM_CONTRIBUTORS)
-                if contributors:
-                    insert_contributors(cursor, repo['id'], contributors)
-                    print(f"inserted contributors for: {repo['name']}")
-                insert_processed_repo(cursor, repo['id'], language, sort_by)
-                cursor.connection.commit()
-            
-            except Exception as e:
-                print(f"error processing repo {repo['name']}: {e}")
-                cursor.connection.rollback()  
-                continue                
-        page += 1
-                
 # CSV save                
-def export_to_csv(cursor, filename):
-    cursor.execute("SELECT * FROM repositories")
-    repos = cursor.fetchall()
-    with open(filename, 'a', newline='') as csvfile:
+# streams rows out chunk_size at a time so memory stays flat however big the table is.
+# since=None writes a full snapshot, otherwise only repos synced after that watermark.
+# either way the file is written fresh with one header, and the newest synced_at
+# written becomes the watermark for the next --since last.
+@metrics.timed('csv.export_repos')
+def export_to_csv(cursor, filename, since=None, chunk_size=EXPORT_CHUNK_SIZE):
+    columns = ', '.join(EXPORT_COLUMNS)
+    if since is None:
+        cursor.execute(f"SELECT {columns}, synced_at FROM repositories")
+    else:
+        cursor.execute(f"SELECT {columns}, synced_at FROM repositories WHERE synced_at > ?", (since,))
+
+    # a full snapshot covers the NULL synced_at rows too, so the next export only
+    # needs anything synced at all ('' sorts before every timestamp)
+    watermark = since if since is not None else ''
+    exported = 0
+    with open(filename, 'w', newline='') as csvfile:
         csv_writer = csv.writer(csvfile)
-        csv_writer.writerow([i[0] for i in cursor.description])
-        csv_writer.writerows(repos)
-    
+        csv_writer.writerow(EXPORT_COLUMNS)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            csv_writer.writerows(row[:-1] for row in rows)
+            synced = [row[-1] for row in rows if row[-1] is not None]
+            if synced and max(synced) > watermark:
+                watermark = max(synced)
+            exported += len(rows)
+
+    set_export_watermark(cursor, watermark)
+    cursor.connection.commit()
+    metrics.count('csv_rows', exported, file='repositories')
+    print(f'exported {exported} repos to {filename}')
+    return exported
+
+def get_export_watermark(cursor, name='repositories_csv'):
+    cursor.execute('SELECT watermark FROM export_state WHERE name = ?', (name,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def set_export_watermark(cursor, watermark, name='repositories_csv'):
+    cursor.execute('''
+            INSERT INTO export_state (name, watermark) VALUES (?, ?)
+            ON CONFLICT (name) DO UPDATE SET watermark = excluded.watermark
+        ''', (name, watermark))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='crawl high star/fork repos and their top contributors')
+    parser.add_argument('--db', default=LOCAL_DB_FILE)
+    parser.add_argument('--languages', nargs='+', default=LANGUAGES)
+    parser.add_argument('--migrate', action='store_true',
+                        help='only bring the db schema up to date (dedups contributors), no crawl')
+    parser.add_argument('--refresh', action='store_true',
+                        help='also re-crawl already processed repos whose stars/forks/updated_at changed')
+    parser.add_argument('--export-only', action='store_true', help='skip the crawl, just write the CSV')
+    parser.add_argument('--since', metavar='WATERMARK',
+                        help="only export repos synced after this ('last' = where the previous export stopped)")
+    parser.add_argument('--num-repos', type=int,
+                        help=f'new repos per language/sort pair (default: everything search returns). '
+                             f'over {MAX_SEARCH_PAGE * PER_PAGE} turns on --shard')
+    parser.add_argument('--shard', action='store_true',
+                        help='split searches into star/fork ranges to get past the 1000 result cap')
+    parser.add_argument('--search-workers', type=int, default=SEARCH_WORKERS)
+    parser.add_argument('--record-workers', type=int, default=RECORD_WORKERS)
+    parser.add_argument('--contributor-workers', type=int, default=CONTRIBUTOR_WORKERS)
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE, help='max items waiting in front of each stage')
+    parser.add_argument('--report-seconds', type=float, default=REPORT_SECONDS,
+                        help='print queue depths and stage rates this often (0 = only at the end)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--batch-seconds', type=float, default=BATCH_SECONDS)
+    parser.add_argument('--synchronous', default=SYNCHRONOUS, choices=['OFF', 'NORMAL', 'FULL'])
+    parser.add_argument('--metrics-file', help='write stage timings/counters here in prometheus text format')
+    parser.add_argument('--profile', metavar='FILE', help='run under cProfile and dump the stats here')
+    parser.add_argument('--archive', metavar='DIR',
+                        help='also log every raw api response to gzipped segments in this directory (see replay.py)')
+    return parser.parse_args(argv)
+
 
 # the bit that does the thing:
-def main():
+def main(argv=None):
+    args = parse_args(argv)
+    profiler = metrics.start_profile(args.profile)
+    payloads.open_archive(args.archive)
     
-    conn = sqlite3.connect(LOCAL_DB_FILE)
+    conn = sqlite3.connect(args.db)
+    configure_connection(conn, args.synchronous)
     cursor = conn.cursor()
+    writer = BatchWriter(cursor, batch_size=args.batch_size, max_wait=args.batch_seconds)
+    since = None
  
     try:
         create_tables(cursor)
         conn.commit()
+        if args.migrate:
+            print(f'{args.db} schema up to date')
+            return
+        since = get_export_watermark(cursor) if args.since == 'last' else args.since
 
-        for language in LANGUAGES:
-            for sort_by in ["forks", "stars"]:
-            
-                print(f'grabbing high {sort_by} repos with {language}...')
-                fetch_and_store_repos_by_criteria(cursor, language, sort_by, num_repos= NUM_REPOS)
-        
-        export_to_csv(cursor, CSV_OUTPUT_FILE)
+        if not args.export_only:
+            crawl_pipeline(
+                cursor, args.languages, num_repos=args.num_repos, writer=writer, refresh=args.refresh,
+                search_workers=args.search_workers, record_workers=args.record_workers,
+                contributor_workers=args.contributor_workers, queue_size=args.queue_size,
+                report_every=args.report_seconds,
+                sharded=args.shard or (args.num_repos or 0) > MAX_SEARCH_PAGE * PER_PAGE,
+            )
+
+        export_to_csv(cursor, CSV_OUTPUT_FILE, since=since)
         print(f'CSV exported to {CSV_OUTPUT_FILE}')
+        http_cache.print_stats()
+        BUDGET.print_stats()
         
     except KeyboardInterrupt:
         print('\n keyboard interruption, stopping')
-        export_to_csv(cursor, CSV_OUTPUT_FILE)    
+        # everything buffered is fully fetched, keep it
+        writer.flush()
         conn.rollback()
+        export_to_csv(cursor, CSV_OUTPUT_FILE, since=since)
     except Exception as e:
         print(f'error: {e}')
         conn.rollback()
@@ -221,6 +617,8 @@ def main():
         cursor.close()
         conn.close()
         print('db connection closed')
+        payloads.close_archive()
+        metrics.report(args.metrics_file, profiler, args.profile)
             
 if __name__ == "__main__":
     main()
@@ -0,0 +1,78 @@
+import argparse
+
+# one entry point for the scripts: gitgrab <command> [args]. a command's module
+# is only imported once it's been picked, so `gitgrab export` never loads
+# requests / tweepy / pandas, and config.json isn't read until a request goes out.
+# anything gitgrab doesn't know goes on to the script's own parser, so
+# `gitgrab crawl --help` shows the crawler's flags.
+CRAWL_ENGINES = {
+    'pipeline': 'forks_and_stars',  # fetch / decode / contributors / db stages, one process
+    'async': 'async_crawler',       # many requests in flight, one process
+    'workers': 'coordinator',       # several processes sharing a work queue in the db
+}
+
+
+# __import__ rather than importlib.import_module, -X importtime only sees the former
+def crawl(args, rest):
+    return __import__(CRAWL_ENGINES[args.engine]).main(rest)
+
+
+def export(args, rest):
+    if args.combined:
+        import combo_table
+        return combo_table.main(rest)
+    import forks_and_stars
+    return forks_and_stars.main(['--export-only', *rest])
+
+
+def enrich(args, rest):
+    import first_draft
+    return first_draft.main(rest)
+
+
+def history(args, rest):
+    import snapshots
+    return snapshots.main(rest)
+
+
+# not called replay, that's the module
+def replay_archive(args, rest):
+    import replay
+    return replay.main(rest)
+
+
+def twitter(args, rest):
+    import twits2
+    return twits2.main(rest)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='gitgrab', description='crawl github repos and contributors, and friends')
+    commands = parser.add_subparsers(dest='command', required=True, metavar='command')
+
+    # add_help=False so --help reaches the script behind the command
+    def command(name, func, help):
+        sub = commands.add_parser(name, help=help, add_help=False, allow_abbrev=False)
+        sub.set_defaults(func=func)
+        return sub
+
+    sub = command('crawl', crawl, 'crawl repos and their top contributors into the db (--engine pipeline|async|workers)')
+    sub.add_argument('--engine', choices=CRAWL_ENGINES, default='pipeline',
+                     help=', '.join(f'{name}: {module}.py' for name, module in CRAWL_ENGINES.items()))
+    sub = command('export', export, 'write the repos csv from the db, no crawling')
+    sub.add_argument('--combined', action='store_true',
+                     help='repos joined with contributors instead (combo_table.py, takes --parquet)')
+    command('enrich', enrich, 'look up contact info for stored contributors (first_draft.py)')
+    command('history', history, 'fold exported csvs into one history, as-of / delta queries (snapshots.py)')
+    command('replay', replay_archive, "rebuild the db from a crawl's --archive, no api calls (replay.py)")
+    command('twitter', twitter, 'find and rank twitter users by keyword (twits2.py)')
+    return parser.parse_known_args(argv)
+
+
+def main(argv=None):
+    args, rest = parse_args(argv)
+    return args.func(args, rest)
+
+
+if __name__ == "__main__":
+    main()
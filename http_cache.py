@@ -0,0 +1,145 @@
+import sqlite3
+import threading
+import time
+
+POOL_SIZE = 16
+CACHE_FILE = 'http_cache.db'
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+_lock = threading.Lock()
+_session = None
+_cache = None
+
+
+# one keep-alive session for the whole process instead of a fresh
+# tcp + tls handshake on every requests.get. requests is imported here, not at
+# the top, so exports and other offline runs don't pay for loading it
+def get_session():
+    global _session
+    with _lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+    return _session
+
+
+# on-disk cache of response bodies keyed by url. we keep the ETag / Last-Modified
+# github hands back and revalidate with them, an unchanged resource comes back
+# as a 304 which doesn't count against the rate limit.
+class ResponseCache:
+    def __init__(self, path=CACHE_FILE, max_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0          # 304, served from the cache
+        self.misses = 0        # nothing cached, full download
+        self.refreshed = 0     # cached but changed upstream, full download
+        self._lock = threading.Lock()
+        # crawl worker processes share the file, give each other time to commit
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=OFF')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+            url TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            body BLOB,
+            size INTEGER,
+            last_used REAL
+            );
+        ''')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used)')
+        self.total_bytes = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def validators(self, url):
+        with self._lock:
+            row = self.conn.execute('SELECT etag, last_modified FROM responses WHERE url = ?', (url,)).fetchone()
+        headers = {}
+        if row and row[0]:
+            headers['If-None-Match'] = row[0]
+        if row and row[1]:
+            headers['If-Modified-Since'] = row[1]
+        return headers
+
+    def body(self, url):
+        with self._lock:
+            row = self.conn.execute('SELECT body FROM responses WHERE url = ?', (url,)).fetchone()
+            if row:
+                self.conn.execute('UPDATE responses SET last_used = ? WHERE url = ?', (time.time(), url))
+                self.conn.commit()
+        return row[0] if row else None
+
+    def put(self, url, response):
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+        body = response.content
+        with self._lock:
+            old = self.conn.execute('SELECT size FROM responses WHERE url = ?', (url,)).fetchone()
+            self.conn.execute('''
+                INSERT OR REPLACE INTO responses (url, etag, last_modified, body, size, last_used)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (url, etag, last_modified, body, len(body), time.time()))
+            self.total_bytes += len(body) - (old[0] if old else 0)
+            self._evict()
+            self.conn.commit()
+
+    # drop least recently used entries until we're back under max_bytes
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        victims = []
+        for url, size in self.conn.execute('SELECT url, size FROM responses ORDER BY last_used'):
+            if self.total_bytes <= self.max_bytes:
+                break
+            victims.append((url,))
+            self.total_bytes -= size
+        self.conn.executemany('DELETE FROM responses WHERE url = ?', victims)
+
+    def count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        return f'http cache: {self.hits} hits (304), {self.misses} misses, {self.refreshed} refreshed'
+
+
+def get_cache():
+    global _cache
+    with _lock:
+        if _cache is None:
+            _cache = ResponseCache()
+    return _cache
+
+
+# drop-in for requests.get. a 304 gets the cached body patched in so callers
+# just see a normal 200 (headers, incl. the rate limit ones, stay from the 304)
+def cached_get(url, headers=None, cache=None):
+    cache = cache or get_cache()
+    conditional = cache.validators(url)
+    response = get_session().get(url, headers={**(headers or {}), **conditional})
+
+    if response.status_code == 304:
+        body = cache.body(url)
+        if body is not None:
+            cache.count('hits')
+            response.status_code = 200
+            response._content = body
+            return response
+        # entry vanished between validators() and now, ask again without validators
+        response = get_session().get(url, headers=headers)
+
+    if response.status_code == 200:
+        cache.count('refreshed' if conditional else 'misses')
+        cache.put(url, response)
+    return response
+
+
+def print_stats():
+    if _cache is not None:
+        print(_cache.stats())
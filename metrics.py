@@ -0,0 +1,150 @@
+import cProfile
+import functools
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = 'gitgrab'
+PROFILE_TOP = 25
+
+
+# wall time per stage (network wait, rate limit sleeps, json decode, sqlite
+# writes/commits, csv writes) plus plain event counters, shared by every thread.
+# stages are named '<area>.<what>', e.g. 'github.http' or 'db.commit'; counters
+# can carry labels, e.g. count('github_responses', status=403)
+class Metrics:
+    def __init__(self):
+        self.stages = {}    # stage -> [calls, total seconds, max seconds]
+        self.counters = {}  # (name, ((label, value), ...)) -> n
+        self.gauges = {}    # same keys, last value set wins
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(stage, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def timed(self, stage):
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def count(self, name, n=1, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    # a level rather than a tally, e.g. how deep a queue got
+    def gauge(self, name, value, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self.gauges[key] = value
+
+    def print_summary(self):
+        with self._lock:
+            stages = sorted(self.stages.items(), key=lambda item: -item[1][1])
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+        if not stages and not counters and not gauges:
+            return
+        elapsed = time.time() - self.started
+        print(f'\n{"stage":<28}{"calls":>8}{"seconds":>10}{"mean ms":>10}{"max ms":>10}{"% run":>8}')
+        for stage, (calls, total, longest) in stages:
+            print(f'{stage:<28}{calls:>8}{total:>10.2f}{total / calls * 1000:>10.1f}{longest * 1000:>10.1f}'
+                  f'{total / elapsed * 100:>7.1f}%')
+        for (name, labels), n in counters + gauges:
+            label = ','.join(f'{k}={v}' for k, v in labels)
+            print(f'{name + (f"{{{label}}}" if label else ""):<28}{n:>8}')
+        print(f'run time {elapsed:.2f}s (threads overlap, so stages can add up to more)')
+
+    # prometheus text exposition format, written to a temp file and renamed so
+    # a scraper (e.g. node_exporter's textfile collector) never sees half a file
+    def write_prometheus(self, path):
+        with self._lock:
+            stages = sorted(self.stages.items())
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+
+        lines = [
+            f'# HELP {PREFIX}_stage_seconds_total Wall time spent in each pipeline stage.',
+            f'# TYPE {PREFIX}_stage_seconds_total counter',
+            *(f'{PREFIX}_stage_seconds_total{{stage="{stage}"}} {total:.6f}' for stage, (_, total, _) in stages),
+            f'# HELP {PREFIX}_stage_calls_total Times each pipeline stage ran.',
+            f'# TYPE {PREFIX}_stage_calls_total counter',
+            *(f'{PREFIX}_stage_calls_total{{stage="{stage}"}} {calls}' for stage, (calls, _, _) in stages),
+            f'# HELP {PREFIX}_stage_max_seconds Longest single run of each pipeline stage.',
+            f'# TYPE {PREFIX}_stage_max_seconds gauge',
+            *(f'{PREFIX}_stage_max_seconds{{stage="{stage}"}} {longest:.6f}' for stage, (_, _, longest) in stages),
+        ]
+        for name in dict.fromkeys(name for (name, _), _ in counters):
+            lines.append(f'# TYPE {PREFIX}_{name}_total counter')
+            for (other, labels), n in counters:
+                if other == name:
+                    label = ','.join(f'{k}="{v}"' for k, v in labels)
+                    lines.append(f'{PREFIX}_{name}_total{{{label}}} {n}' if label else f'{PREFIX}_{name}_total {n}')
+        for name in dict.fromkeys(name for (name, _), _ in gauges):
+            lines.append(f'# TYPE {PREFIX}_{name} gauge')
+            for (other, labels), value in gauges:
+                if other == name:
+                    label = ','.join(f'{k}="{v}"' for k, v in labels)
+                    lines.append(f'{PREFIX}_{name}{{{label}}} {value}' if label else f'{PREFIX}_{name} {value}')
+        lines += [
+            f'# TYPE {PREFIX}_last_run_timestamp_seconds gauge',
+            f'{PREFIX}_last_run_timestamp_seconds {time.time():.0f}',
+        ]
+
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp, path)
+
+
+METRICS = Metrics()
+timer = METRICS.timer
+timed = METRICS.timed
+count = METRICS.count
+gauge = METRICS.gauge
+
+
+# cProfile is only switched on when asked for, it slows everything down a fair bit
+def start_profile(profile_file):
+    if not profile_file:
+        return None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profile(profiler, profile_file):
+    if profiler is None:
+        return
+    profiler.disable()
+    profiler.dump_stats(profile_file)
+    print(f'\nprofile written to {profile_file} (python -m pstats {profile_file}), top {PROFILE_TOP} by cumulative time:')
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(PROFILE_TOP)
+
+
+# end of run: profile, summary table, and the scrape file if one was asked for
+def report(metrics_file=None, profiler=None, profile_file=None):
+    stop_profile(profiler, profile_file)
+    METRICS.print_summary()
+    if metrics_file:
+        METRICS.write_prometheus(metrics_file)
+        print(f'metrics written to {metrics_file}')
@@ -0,0 +1,186 @@
+import gzip
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+# orjson decodes a search page several times faster when it's installed,
+# the stdlib does the same job otherwise
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+_lock = threading.Lock()
+_archive = None
+
+
+# the nine fields of a search hit we actually store, named after the columns.
+# a raw hit is ~90 keys with the nested owner/license/topics and a pile of url
+# templates; pages are projected as soon as they're decoded so only these survive.
+class RepoRecord:
+    __slots__ = ('id', 'name', 'url', 'stars', 'forks', 'language', 'owner', 'created_at', 'updated_at')
+
+    def __init__(self, id, name, url, stars, forks, language, owner, created_at, updated_at):
+        self.id = id                    # int
+        self.name = name                # str
+        self.url = url                  # str, the html_url
+        self.stars = stars              # int
+        self.forks = forks              # int
+        self.language = language        # str or None
+        self.owner = owner              # str, the owner's login
+        self.created_at = created_at    # str, iso timestamp
+        self.updated_at = updated_at    # str, iso timestamp
+
+    @classmethod
+    def from_api(cls, item):
+        return cls(
+            item['id'], item['name'], item['html_url'], item['stargazers_count'], item['forks_count'],
+            item['language'], item['owner']['login'], item['created_at'], item['updated_at'],
+        )
+
+    # column order of the repositories table
+    def row(self):
+        return (self.id, self.name, self.url, self.stars, self.forks, self.language, self.owner,
+                self.created_at, self.updated_at)
+
+    def __repr__(self):
+        return f'RepoRecord({self.owner}/{self.name}, id={self.id})'
+
+
+class ContributorRecord:
+    __slots__ = ('login', 'contributions')
+
+    def __init__(self, login, contributions):
+        self.login = login
+        self.contributions = contributions
+
+    @classmethod
+    def from_api(cls, item):
+        return cls(item['login'], item['contributions'])
+
+    def __repr__(self):
+        return f'ContributorRecord({self.login}, {self.contributions})'
+
+
+# body of a /search/repositories response -> records, the decoded page is
+# dropped as soon as this returns
+def repo_page(content):
+    return [RepoRecord.from_api(item) for item in loads(content).get('items', [])]
+
+
+# body of a /contributors response -> the first `limit` contributors
+# (github answers 204 with no body for an empty repo)
+def contributor_page(content, limit=None):
+    if not content.strip():
+        return []
+    return [ContributorRecord.from_api(item) for item in loads(content)[:limit]]
+
+
+# optional archive of every successful raw response, so a schema change can be
+# re-projected later (see replay.py) without re-crawling. it's a directory of
+# append-only gzipped segments, one json line per response:
+# {"url": ..., "fetched_at": ..., "body": <response as github sent it>}
+# bodies go in byte for byte; json can't have a raw newline inside a string, so
+# dropping the pretty-printing newlines is enough to keep each one on its line.
+# an empty body (a 204) or anything that isn't a json object/array goes in as null.
+# a segment is written as <name>.open and renamed once it's SEGMENT_BYTES big or
+# the crawl ends, so readers only ever see finished files. names start with the
+# time the segment was opened and carry the pid, so several crawl processes can
+# share a directory and a sort by name is roughly the order things were fetched.
+SEGMENT_BYTES = 64 * 1024 * 1024    # uncompressed, per segment
+SEGMENT_SUFFIX = '.jsonl.gz'
+COMPRESS_LEVEL = 6                  # gzip's default 9 costs a lot more cpu for a few % less
+
+
+class RawArchive:
+    def __init__(self, path, segment_bytes=SEGMENT_BYTES):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.written = 0
+        self.segments = 0
+        self._file = None
+        self._name = None
+        self._size = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, url, content):
+        fetched_at = datetime.now(timezone.utc).isoformat(timespec='milliseconds')
+        body = content.strip()
+        body = body.replace(b'\r', b'').replace(b'\n', b'') if body[:1] in (b'{', b'[') else b'null'
+        line = b''.join([
+            b'{"url": ', json.dumps(url).encode(), b', "fetched_at": "', fetched_at.encode(), b'", "body": ',
+            body, b'}\n',
+        ])
+        with self._lock:
+            if self._file is None:
+                self._open_segment()
+            self._file.write(line)
+            self._size += len(line)
+            self.written += 1
+            if self._size >= self.segment_bytes:
+                self._close_segment()
+
+    def _open_segment(self):
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+        self._name = os.path.join(self.path, f'{stamp}-{os.getpid()}-{self.segments:04d}{SEGMENT_SUFFIX}')
+        self._file = gzip.open(self._name + '.open', 'wb', compresslevel=COMPRESS_LEVEL)
+        self._size = 0
+        self.segments += 1
+
+    def _close_segment(self):
+        self._file.close()
+        os.replace(self._name + '.open', self._name)
+        self._file = None
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._close_segment()
+
+
+# finished segments, oldest first. a single file (archives from before
+# segments) is its own one segment
+def archive_segments(path):
+    if os.path.isfile(path):
+        return [path]
+    return sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(SEGMENT_SUFFIX))
+
+
+def segment_lines(path):
+    with gzip.open(path, 'rb') as f:
+        yield from f
+
+
+def read_segment(path):
+    for line in segment_lines(path):
+        yield loads(line)
+
+
+def read_archive(path):
+    for segment in archive_segments(path):
+        yield from read_segment(segment)
+
+
+def open_archive(path):
+    global _archive
+    with _lock:
+        if path and _archive is None:
+            _archive = RawArchive(path)
+    return _archive
+
+
+def close_archive():
+    global _archive
+    with _lock:
+        if _archive is not None:
+            _archive.close()
+            print(f'archived {_archive.written} raw responses to {_archive.path}/ ({_archive.segments} segments)')
+            _archive = None
+
+
+def archive(url, content):
+    if _archive is not None:
+        _archive.write(url, content)
@@ -0,0 +1,200 @@
+import queue
+import threading
+import time
+
+import metrics
+
+QUEUE_SIZE = 64
+REPORT_SECONDS = 10
+IDLE_SECONDS = 1     # how long a stage waits for input before running its on_idle
+
+_DONE = object()
+
+
+class _Stopped(Exception):
+    pass
+
+
+# one step of a Pipeline. `workers` threads take items off a bounded input queue
+# and run func(item, emit); emit hands a result to the next stage and blocks
+# while that stage's queue is full, which is what stops a fast stage running
+# away from a slow one (and keeps memory to roughly the sum of the queue sizes).
+# on_idle runs whenever nothing has arrived for IDLE_SECONDS (e.g. a time based
+# flush), on_done once after the last item.
+class Stage:
+    def __init__(self, name, func, workers=1, queue_size=QUEUE_SIZE, on_idle=None, on_done=None):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.on_idle = on_idle
+        self.on_done = on_done
+        self.processed = 0
+        self.emitted = 0
+        self.errors = 0
+        self.busy = 0.0       # seconds inside func, summed over workers
+        self.blocked = 0.0    # of which waiting on a full downstream queue
+        self.max_depth = 0
+        self.running = 0
+        self._lock = threading.Lock()
+
+    def depth(self):
+        depth = self.queue.qsize()
+        self.max_depth = max(self.max_depth, depth)
+        return depth
+
+    # blocking put that still notices the pipeline being torn down
+    def put(self, item, stopping):
+        while True:
+            try:
+                self.queue.put(item, timeout=IDLE_SECONDS)
+                break
+            except queue.Full:
+                if stopping.is_set():
+                    raise _Stopped()
+        self.depth()
+
+
+# stages connected by bounded queues. every stage but the last runs on its own
+# threads; the last one (the sink, one worker) runs on the thread that called
+# run(), so it can own things that don't like being shared across threads, such
+# as a sqlite connection. a stage's throughput, how busy its workers are and how
+# long they sat blocked on the next queue show which one holds the rest up:
+# the slowest stage is the busiest, everything upstream of it is blocked.
+class Pipeline:
+    def __init__(self, stages, name='pipeline', report_every=REPORT_SECONDS):
+        if stages[-1].workers != 1:
+            raise ValueError('the last stage runs on the calling thread, it gets one worker')
+        self.stages = stages
+        self.name = name
+        self.report_every = report_every
+        self.started = None
+        self.elapsed = 0.0
+        self._stopping = threading.Event()
+        self._finished = threading.Event()
+
+    def run(self, items):
+        self.started = time.perf_counter()
+        threads = [threading.Thread(target=self._feed, args=(items,), name=f'{self.name}-feed', daemon=True)]
+        for i, stage in enumerate(self.stages[:-1]):
+            stage.running = stage.workers
+            threads += [
+                threading.Thread(target=self._work, args=(stage, self.stages[i + 1]),
+                                 name=f'{self.name}-{stage.name}-{n}', daemon=True)
+                for n in range(stage.workers)
+            ]
+        if self.report_every:
+            threads.append(threading.Thread(target=self._monitor, name=f'{self.name}-monitor', daemon=True))
+        for thread in threads:
+            thread.start()
+
+        sink = self.stages[-1]
+        sink.running = 1
+        try:
+            self._work(sink, None)
+        finally:
+            # on an error or ctrl-c in the sink the other stages just stop where
+            # they are, whatever is still queued is dropped
+            self._stopping.set()
+            self._finished.set()
+            self.elapsed = time.perf_counter() - self.started
+            self.record()
+        self.print_summary()
+
+    def _feed(self, items):
+        first = self.stages[0]
+        try:
+            for item in items:
+                first.put(item, self._stopping)
+            for _ in range(first.workers):
+                first.put(_DONE, self._stopping)
+        except _Stopped:
+            pass
+
+    def _emit(self, stage, downstream, blocked, item):
+        if downstream is None:
+            raise RuntimeError(f'{stage.name} is the last stage, it has nowhere to emit to')
+        start = time.perf_counter()
+        downstream.put(item, self._stopping)
+        blocked[0] += time.perf_counter() - start
+        with stage._lock:
+            stage.emitted += 1
+
+    def _work(self, stage, downstream):
+        blocked = [0.0]
+        emit = lambda item: self._emit(stage, downstream, blocked, item)
+        try:
+            while True:
+                try:
+                    item = stage.queue.get(timeout=IDLE_SECONDS)
+                except queue.Empty:
+                    if self._stopping.is_set():
+                        return
+                    if stage.on_idle:
+                        stage.on_idle()
+                    continue
+                if item is _DONE:
+                    break
+
+                blocked[0] = 0.0
+                start = time.perf_counter()
+                try:
+                    stage.func(item, emit)
+                except _Stopped:
+                    return
+                except Exception as e:
+                    with stage._lock:
+                        stage.errors += 1
+                    metrics.count('pipeline_errors', stage=stage.name)
+                    print(f'{stage.name} error: {e}')
+                elapsed = time.perf_counter() - start
+                metrics.METRICS.observe(f'{self.name}.{stage.name}', elapsed - blocked[0])
+                with stage._lock:
+                    stage.processed += 1
+                    stage.busy += elapsed
+                    stage.blocked += blocked[0]
+        finally:
+            with stage._lock:
+                stage.running -= 1
+                last = stage.running == 0
+
+        # the last worker out closes the stage and tells the next one
+        if last and not self._stopping.is_set():
+            if stage.on_done:
+                stage.on_done()
+            if downstream is not None:
+                try:
+                    for _ in range(downstream.workers):
+                        downstream.put(_DONE, self._stopping)
+                except _Stopped:
+                    pass
+
+    def _monitor(self):
+        last = {stage.name: 0 for stage in self.stages}
+        while not self._finished.wait(self.report_every):
+            parts = []
+            for stage in self.stages:
+                done = stage.processed
+                rate = (done - last[stage.name]) / self.report_every
+                last[stage.name] = done
+                parts.append(f'{stage.name}[q {stage.depth()}/{stage.queue.maxsize}] {done} @{rate:.1f}/s')
+            print(f'{self.name} {time.perf_counter() - self.started:.0f}s  ' + '  '.join(parts))
+
+    # per stage counters and gauges for metrics.report / the prometheus file
+    def record(self):
+        for stage in self.stages:
+            stage.depth()
+            metrics.count('pipeline_items', stage.processed, stage=stage.name)
+            metrics.gauge('pipeline_blocked_seconds', round(stage.blocked, 3), stage=stage.name)
+            metrics.gauge('pipeline_queue_depth_max', stage.max_depth, stage=stage.name)
+            metrics.gauge('pipeline_workers', stage.workers, stage=stage.name)
+
+    def print_summary(self):
+        elapsed = self.elapsed or 1e-9
+        print(f'\n{self.name} ran {self.elapsed:.2f}s')
+        print(f'{"stage":<16}{"workers":>8}{"items":>8}{"items/s":>9}{"work %":>8}{"blocked %":>11}{"max queue":>11}{"errors":>8}')
+        for stage in self.stages:
+            capacity = elapsed * stage.workers
+            print(f'{stage.name:<16}{stage.workers:>8}{stage.processed:>8}{stage.processed / elapsed:>9.1f}'
+                  f'{(stage.busy - stage.blocked) / capacity * 100:>7.0f}%{stage.blocked / capacity * 100:>10.0f}%'
+                  f'{f"{stage.max_depth}/{stage.queue.maxsize}":>11}{stage.errors:>8}')
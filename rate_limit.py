@@ -0,0 +1,160 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+# what a fresh token is assumed to have before github tells us otherwise
+DEFAULT_LIMITS = {'core': 5000, 'search': 30}
+
+
+# github keeps separate quotas for search and everything else
+def resource_for(url):
+    return 'search' if '/search/' in url else 'core'
+
+
+def mask(token):
+    return f'{token[:4]}…{token[-4:]}' if token and len(token) > 8 else '(default)'
+
+
+class _Bucket:
+    def __init__(self, resource):
+        self.resource = resource
+        self.remaining = None   # unknown until the first response comes back
+        self.reset_at = 0
+        self.in_flight = 0
+        self.requests = 0
+        self.exhausted = 0      # times this bucket hit zero
+
+    def headroom(self):
+        remaining = DEFAULT_LIMITS.get(self.resource, 0) if self.remaining is None else self.remaining
+        return remaining - self.in_flight
+
+
+class _Slot:
+    def __init__(self, token):
+        self.auth = {"Authorization": f"token {token}"} if token else {}
+        self.headers = None
+
+    def observe(self, headers):
+        self.headers = headers
+
+
+# one budget shared by every worker, across one or more tokens. for each token
+# and resource it mirrors what github reports in X-RateLimit-Remaining /
+# X-RateLimit-Reset and counts requests still in flight against it, so concurrent
+# workers can't overshoot between responses. each request goes to the token with
+# the most headroom left, and we only wait once every token is spent.
+# tokens=None means a single slot that leaves the caller's auth header alone.
+# tokens can also be a function returning the list, it's only called when the
+# first request goes out so a budget can exist before credentials are loaded.
+class RateLimitBudget:
+    def __init__(self, tokens=None, headroom=0):
+        self._tokens = tokens if callable(tokens) else list(tokens) if tokens else [None]
+        self.headroom = headroom
+        self.waits = 0
+        self._noticed = {}
+        self._buckets = {}
+        self._cond = threading.Condition()
+
+    @property
+    def tokens(self):
+        if callable(self._tokens):
+            self._tokens = list(self._tokens() or []) or [None]
+        return self._tokens
+
+    @contextmanager
+    def slot(self, url):
+        resource = resource_for(url)
+        bucket, token = self._acquire(resource)
+        slot = _Slot(token)
+        try:
+            yield slot
+        finally:
+            self._release(bucket, slot.headers)
+
+    def _bucket(self, token, resource):
+        return self._buckets.setdefault((token, resource), _Bucket(resource))
+
+    def _acquire(self, resource):
+        with self._cond:
+            while True:
+                now = time.time()
+                best = None
+                for token in self.tokens:
+                    bucket = self._bucket(token, resource)
+                    if bucket.reset_at and now >= bucket.reset_at:
+                        bucket.remaining, bucket.reset_at = None, 0
+                    if bucket.headroom() > self.headroom and (best is None or bucket.headroom() > best[0].headroom()):
+                        best = (bucket, token)
+                if best:
+                    best[0].in_flight += 1
+                    best[0].requests += 1
+                    return best
+
+                resets = [self._bucket(token, resource).reset_at for token in self.tokens]
+                wait = max(min(resets) - now, 0) + 1
+                self.waits += 1
+                # every waiting worker ends up here, only say it once per reset
+                if self._noticed.get(resource) != min(resets):
+                    self._noticed[resource] = min(resets)
+                    print(f'{resource} budget spent on all {len(self.tokens)} token(s), waiting {wait / 60:.2f} minutes for reset')
+                with metrics.timer('github.rate_limit_wait'):
+                    self._cond.wait(timeout=wait)
+
+    def _release(self, bucket, headers):
+        with self._cond:
+            bucket.in_flight -= 1
+            if headers and 'X-RateLimit-Remaining' in headers:
+                remaining = int(headers['X-RateLimit-Remaining'])
+                reset_at = int(headers.get('X-RateLimit-Reset', 0))
+                before = bucket.remaining
+                # responses can land out of order, only trust the lowest count per window
+                if reset_at > bucket.reset_at or bucket.remaining is None:
+                    bucket.remaining, bucket.reset_at = remaining, reset_at
+                elif reset_at == bucket.reset_at:
+                    bucket.remaining = min(bucket.remaining, remaining)
+                if bucket.remaining == 0 and before != 0:
+                    bucket.exhausted += 1
+            self._cond.notify_all()
+
+    def snapshot(self):
+        with self._cond:
+            return {(mask(token), b.resource): (b.remaining, b.reset_at) for (token, _), b in self._buckets.items()}
+
+    def print_stats(self):
+        with self._cond:
+            print(f'\n{"token":<12}{"resource":<10}{"requests":>10}{"remaining":>11}{"exhausted":>11}')
+            for (token, resource), b in sorted(self._buckets.items(), key=lambda item: (self.tokens.index(item[0][0]), item[0][1])):
+                remaining = '?' if b.remaining is None else b.remaining
+                print(f'{mask(token):<12}{resource:<10}{b.requests:>10}{remaining:>11}{b.exhausted:>11}')
+            print(f'waited for a reset {self.waits} time(s)')
+
+    # plain numbers per token/resource, for combining budgets kept in different
+    # processes (see print_combined_stats)
+    def counts(self):
+        with self._cond:
+            rows = [(mask(token), b.resource, b.requests, b.remaining, b.exhausted)
+                    for (token, _), b in self._buckets.items()]
+            return rows, self.waits
+
+
+# one table for the budgets of several processes, e.g. coordinator workers.
+# workers can share a token, so its requests and exhaustions add up and
+# remaining is the lowest any of them saw
+def print_combined_stats(counts):
+    totals = {}
+    waits = 0
+    for rows, budget_waits in counts:
+        waits += budget_waits
+        for token, resource, requests, remaining, exhausted in rows:
+            total = totals.setdefault((token, resource), [0, None, 0])
+            total[0] += requests
+            if remaining is not None:
+                total[1] = remaining if total[1] is None else min(total[1], remaining)
+            total[2] += exhausted
+    print(f'\n{"token":<12}{"resource":<10}{"requests":>10}{"remaining":>11}{"exhausted":>11}')
+    for (token, resource), (requests, remaining, exhausted) in sorted(totals.items()):
+        remaining = '?' if remaining is None else remaining
+        print(f'{token:<12}{resource:<10}{requests:>10}{remaining:>11}{exhausted:>11}')
+    print(f'{len(counts)} budget(s) waited for a reset {waits} time(s) in all')
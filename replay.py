@@ -0,0 +1,197 @@
+import argparse
+import multiprocessing
+import os
+import re
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import metrics
+import payloads
+from forks_and_stars import (
+    BATCH_SECONDS, LOCAL_DB_FILE, PER_PAGE, BatchWriter, configure_connection, create_tables,
+    get_export_watermark, set_export_watermark,
+)
+
+REPLAY_BATCH_SIZE = 1000    # nothing waits on the network here, so much bigger transactions than a crawl
+CONTRIBUTORS_PATH = re.compile(r'/repos/([^/]+)/([^/]+)/contributors$')
+LANGUAGE_QUALIFIER = re.compile(r'language:(\S+)')
+
+
+# one archived response -> what the crawl did with it:
+#   ('search', language, sort_by, fetched_at, [repo rows])    a page of search hits
+#   ('contributors', owner, name, fetched_at, [(login, n)])   one repo's top contributors
+# per_page=1 searches are search_shards' planning probes, the crawl never
+# stored their hits, so they're left out like anything else we don't recognise
+def parse_response(record):
+    url = urlsplit(record['url'])
+    query = parse_qs(url.query)
+    per_page = int(query.get('per_page', [PER_PAGE])[0])
+    body = record['body']
+
+    if url.path.endswith('/search/repositories'):
+        if not isinstance(body, dict):
+            return None
+        language = LANGUAGE_QUALIFIER.search(query.get('q', [''])[0])
+        if per_page < PER_PAGE or language is None:
+            return None
+        rows = [payloads.RepoRecord.from_api(item).row() for item in body.get('items', [])]
+        return ('search', unquote(language.group(1)), query.get('sort', [''])[0], record['fetched_at'], rows)
+
+    match = CONTRIBUTORS_PATH.search(url.path)
+    if match:
+        # a null body is github's 204 for an empty repo, the crawl stored it without contributors
+        contributors = [(c.login, c.contributions) for c in map(payloads.ContributorRecord.from_api, (body or [])[:per_page])]
+        return ('contributors', unquote(match.group(1)), unquote(match.group(2)), record['fetched_at'], contributors)
+    return None
+
+
+# runs in a pool worker: decompress, decode and project one segment. only the
+# few fields we keep travel back to the writer, not the decoded pages. a line
+# that doesn't decode (say a body cut short) is skipped, not the whole replay
+def parse_segment(path):
+    events, skipped = [], 0
+    for line in payloads.segment_lines(path):
+        try:
+            event = parse_response(payloads.loads(line))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            print(f'{os.path.basename(path)}: skipping an unreadable response ({type(e).__name__}: {e})')
+            event = None
+        if event is None:
+            skipped += 1
+        else:
+            events.append(event)
+    return path, events, skipped
+
+
+# parsed segments in order, with at most `ahead` of them parsed but not yet
+# written so a slow writer doesn't have the whole archive pile up in memory
+def parsed_segments(pool, segments, ahead):
+    pending = deque()
+    for path in segments:
+        pending.append(pool.submit(parse_segment, path))
+        if len(pending) >= ahead:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+# the archive says when a response was fetched, the db keeps synced_at in
+# sqlite's own utc format
+def synced_at(fetched_at):
+    return sqlite_time(datetime.fromisoformat(fetched_at))
+
+
+def sqlite_time(moment):
+    moment = moment.astimezone(timezone.utc)
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.') + f'{moment.microsecond // 1000:03d}'
+
+
+# replayed rows carry their fetch time as synced_at, which can be older than
+# where the last incremental export stopped. pull the watermark back to just
+# before the oldest of them so the next --since last still picks them all up
+def lower_export_watermark(cursor, earliest):
+    watermark = get_export_watermark(cursor)
+    if not watermark or earliest > watermark:
+        return
+    lowered = sqlite_time(datetime.fromisoformat(earliest).replace(tzinfo=timezone.utc) - timedelta(milliseconds=1))
+    set_export_watermark(cursor, lowered)
+    cursor.connection.commit()
+    print(f'export watermark moved back from {watermark} to {lowered} to cover the replayed rows')
+
+
+# rebuilds the crawl tables from an archive (see payloads.RawArchive) through the
+# same BatchWriter / insert_* path a crawl uses, at disk speed and no api quota.
+# segments are parsed in parallel, rows are written by this process alone and in
+# segment order, which is the order they were fetched in. as in the crawl a repo
+# is stored once its contributors come back, using the newest search hit for it
+# (and that search's language/sort as its processed_repos entry). synced_at is
+# the fetch time, so repo_history comes back with the original dates (and the
+# export watermark is moved back to match, see lower_export_watermark).
+def replay(cursor, archive, workers=None, batch_size=REPLAY_BATCH_SIZE, batch_seconds=BATCH_SECONDS):
+    segments = payloads.archive_segments(archive)
+    if os.path.isdir(archive):
+        unfinished = [name for name in os.listdir(archive) if name.endswith(payloads.SEGMENT_SUFFIX + '.open')]
+        if unfinished:
+            print(f'skipping {len(unfinished)} unfinished segment(s) (a crawl still writing, or one that was killed)')
+    if not segments:
+        raise SystemExit(f'no archive segments in {archive}')
+
+    writer = BatchWriter(cursor, batch_size=batch_size, max_wait=batch_seconds)
+    hits = {}   # 'owner/name' -> (repo row, language, sort_by) from the newest search page
+    stats = dict.fromkeys(['responses', 'skipped', 'repos', 'orphans'], 0)
+    earliest = None     # oldest synced_at handed to the writer
+    workers = min(workers or os.cpu_count(), len(segments))
+
+    # spawn like the coordinator, the pool doesn't inherit this process' sqlite connection.
+    # with one worker there's nothing to overlap, parse right here
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) if workers > 1 else None
+    try:
+        parsed = parsed_segments(pool, segments, workers * 2) if pool else map(parse_segment, segments)
+        for done, (path, events, skipped) in enumerate(parsed, 1):
+            stats['responses'] += len(events) + skipped
+            stats['skipped'] += skipped
+            for kind, a, b, fetched_at, rows in events:
+                if kind == 'search':
+                    for row in rows:
+                        hits[f'{row[6]}/{row[1]}'] = (row, a, b)
+                    continue
+                hit = hits.get(f'{a}/{b}')
+                if hit is None:
+                    # contributors without the search page that found the repo
+                    stats['orphans'] += 1
+                    continue
+                row, language, sort_by = hit
+                repo_id = row[0]
+                stamp = synced_at(fetched_at)
+                earliest = stamp if earliest is None else min(earliest, stamp)
+                writer.add_rows((*row, stamp), [(repo_id, login, n) for login, n in rows],
+                                (repo_id, language, sort_by))
+                stats['repos'] += 1
+            print(f'replayed segment {done}/{len(segments)}: {os.path.basename(path)} ({len(events)} responses)')
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+    writer.flush()
+    if earliest is not None:
+        lower_export_watermark(cursor, earliest)
+    metrics.count('replay_responses', stats['responses'])
+    return stats
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='rebuild the crawl tables from an archive of raw api responses')
+    parser.add_argument('archive', help='--archive directory of a crawl (or a single archive file)')
+    parser.add_argument('--db', default=LOCAL_DB_FILE)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='segments parsed at once')
+    parser.add_argument('--batch-size', type=int, default=REPLAY_BATCH_SIZE)
+    parser.add_argument('--metrics-file', help='write stage timings/counters here in prometheus text format')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    started = time.perf_counter()
+
+    conn = sqlite3.connect(args.db)
+    configure_connection(conn)
+    cursor = conn.cursor()
+    try:
+        create_tables(cursor)
+        conn.commit()
+        stats = replay(cursor, args.archive, args.workers, args.batch_size)
+    finally:
+        cursor.close()
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"{stats['responses']} responses ({stats['responses'] / elapsed:.0f}/s), {stats['repos']} repos written, "
+          f"{stats['skipped']} skipped, {stats['orphans']} contributor lists without a search hit, {elapsed:.2f}s")
+    metrics.report(args.metrics_file)
+
+
+if __name__ == "__main__":
+    main()
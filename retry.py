@@ -0,0 +1,232 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import metrics
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 1         # seconds before the first retry, doubled every attempt after
+BACKOFF_CAP = 60
+SECONDARY_WAIT = 60      # github asks for at least a minute after a secondary rate limit
+BREAKER_THRESHOLD = 5    # consecutive server/network failures before we stop sending
+BREAKER_COOLDOWN = 30    # first pause once it trips, doubles while the api stays down
+BREAKER_MAX_COOLDOWN = 10 * 60
+
+# github says X-RateLimit-*, twitter x-rate-limit-*
+REMAINING_HEADERS = ('X-RateLimit-Remaining', 'x-rate-limit-remaining')
+RESET_HEADERS = ('X-RateLimit-Reset', 'x-rate-limit-reset')
+
+
+def header(headers, names):
+    for name in names:
+        if headers and headers.get(name) is not None:
+            return headers[name]
+    return None
+
+
+# seconds, or an http date
+def retry_after(headers):
+    value = headers.get('Retry-After') if headers else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+# what to do with one response:
+#   'ok'          done, hand it back
+#   'rate_limit'  out of quota, wait for the window (Retry-After or the reset header)
+#   'secondary'   github's secondary limit / abuse detection, wait it out
+#   'server'      5xx / 408 / network trouble, back off and retry, counts towards the breaker
+#   'fail'        any other 4xx, asking again won't change the answer
+def classify(status, headers, text=''):
+    if status < 400:
+        return 'ok'
+    if status == 429 or header(headers, REMAINING_HEADERS) == '0':
+        return 'rate_limit'
+    if status == 403 and (retry_after(headers) is not None or 'rate limit' in (text or '').lower()):
+        return 'secondary'
+    if status >= 500 or status == 408:
+        return 'server'
+    return 'fail'
+
+
+# retries for one api, shared by every thread that talks to it. backoff is
+# exponential with jitter (half fixed, half random, so it always grows but
+# workers don't retry in lockstep). a rate limit pauses every caller, not just
+# the one that hit it. after BREAKER_THRESHOLD server/network failures in a row
+# the breaker opens: nobody sends anything for the cooldown, then a single probe
+# goes out and everyone else waits for its answer. callers wait rather than fail
+# fast while it's open, a crawl can't do anything useful with the api down anyway.
+class RetryPolicy:
+    def __init__(self, name, max_attempts=MAX_ATTEMPTS, base=BACKOFF_BASE, cap=BACKOFF_CAP,
+                 default_rate_wait=60, retry_on=(), breaker_threshold=BREAKER_THRESHOLD,
+                 breaker_cooldown=BREAKER_COOLDOWN):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base = base
+        self.cap = cap
+        self.default_rate_wait = default_rate_wait
+        self.retry_on = retry_on
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.failures = 0        # consecutive server/network failures
+        self.cooldown = breaker_cooldown
+        self.open_until = 0
+        self.probing = False
+        self.paused_until = 0    # shared rate limit pause
+        self._cond = threading.Condition()
+
+    def backoff(self, attempt):
+        ceiling = min(self.cap, self.base * 2 ** attempt)
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+    def rate_limit_wait(self, headers):
+        wait = retry_after(headers)
+        if wait is None:
+            reset = header(headers, RESET_HEADERS)
+            wait = max(int(reset) - time.time(), 0) + 1 if reset else self.default_rate_wait
+        return wait
+
+    # send() makes one attempt. it either returns a response-ish object (anything
+    # with a status_code is classified, anything else counts as success) or raises;
+    # exceptions in retry_on are retried, tweepy-style ones with a .response are
+    # classified by that response. returns the successful result, or None once
+    # attempts run out or the answer is a hard failure. wait_on_rate_limit=False
+    # is for callers whose RateLimitBudget already waits (and can switch tokens).
+    def call(self, send, max_attempts=None, wait_on_rate_limit=True, describe=''):
+        # requests is loaded by whoever sends, importing retry.py shouldn't pull it in
+        from requests.exceptions import RequestException
+        retry_on = (RequestException, *self.retry_on)
+        max_attempts = max_attempts or self.max_attempts
+        for attempt in range(max_attempts):
+            self._wait_for_breaker()
+            self._wait_for_pause()
+
+            response = error = None
+            try:
+                result = send()
+                response = result if hasattr(result, 'status_code') else None
+            except retry_on as e:
+                error = e
+                response = getattr(e, 'response', None)
+            except BaseException:
+                # not ours to handle, but don't leave everyone waiting on a probe that never reports
+                self._abandon_probe()
+                raise
+
+            if response is None and error is None:
+                self._record(True)
+                return result
+            if response is None:
+                outcome, status, headers, text = 'server', type(error).__name__, None, str(error)
+            else:
+                status, headers = response.status_code, response.headers
+                text = getattr(response, 'text', '')
+                outcome = classify(status, headers, text)
+
+            if outcome == 'ok':
+                self._record(True)
+                return result if error is None else None
+
+            metrics.count('wasted_calls', api=self.name, status=status)
+            last = attempt == max_attempts - 1
+            if outcome == 'fail':
+                self._record(True)
+                print(f'{self.name} error {status} {describe}: {text[:200]}')
+                return None
+            if outcome == 'server':
+                self._record(False)
+                print(f'{self.name} {status} {describe}: {text[:200]}')
+                if not last:
+                    self._sleep('backoff', self.backoff(attempt))
+            elif outcome == 'rate_limit':
+                self._record(True)
+                wait = self.rate_limit_wait(headers)
+                # the budget only steps in (and can switch tokens) when the quota is
+                # actually spent. a 429 with quota left, e.g. github's secondary limit,
+                # has to sit out its Retry-After here or we just hammer it again
+                if wait_on_rate_limit or header(headers, REMAINING_HEADERS) != '0':
+                    self._pause(wait)
+                    print(f'{self.name} rate limited, waiting {wait / 60:.2f} minutes for the window to reset')
+                else:
+                    print(f'{self.name} rate limited on one token, retrying on another')
+            else:
+                self._record(True)
+                asked = retry_after(headers)
+                wait = max(SECONDARY_WAIT if asked is None else asked, self.backoff(attempt))
+                print(f'{self.name} secondary rate limit, backing off {wait:.0f}s')
+                self._pause(wait)
+
+            if not last:
+                metrics.count('retries', api=self.name, reason=outcome)
+
+        print(f'{self.name} gave up after {max_attempts} attempts {describe}')
+        metrics.count('gave_up', api=self.name)
+        return None
+
+    def _sleep(self, stage, seconds):
+        with metrics.timer(f'{self.name}.{stage}'):
+            time.sleep(seconds)
+
+    def _pause(self, seconds):
+        with self._cond:
+            self.paused_until = max(self.paused_until, time.time() + seconds)
+
+    def _wait_for_pause(self):
+        delay = self.paused_until - time.time()
+        if delay > 0:
+            self._sleep('rate_limit_wait', delay)
+
+    def _wait_for_breaker(self):
+        with self._cond:
+            if not self.open_until and not self.probing:
+                return
+            start = time.perf_counter()
+            while True:
+                now = time.time()
+                if self.open_until and now < self.open_until:
+                    self._cond.wait(timeout=self.open_until - now)
+                elif self.probing:
+                    self._cond.wait()
+                elif self.open_until:
+                    # cooldown over, this caller is the probe
+                    self.open_until = 0
+                    self.probing = True
+                    break
+                else:
+                    break
+            metrics.METRICS.observe(f'{self.name}.breaker_wait', time.perf_counter() - start)
+
+    def _abandon_probe(self):
+        with self._cond:
+            if self.probing:
+                self.probing = False
+                self.open_until = time.time()
+            self._cond.notify_all()
+
+    def _record(self, healthy):
+        with self._cond:
+            if healthy:
+                if self.probing or self.failures >= self.breaker_threshold:
+                    print(f'{self.name} is answering again, closing the circuit breaker')
+                self.failures = 0
+                self.cooldown = self.breaker_cooldown
+                self.probing = False
+            else:
+                self.failures += 1
+                if self.probing or self.failures == self.breaker_threshold:
+                    if self.probing:
+                        self.cooldown = min(self.cooldown * 2, BREAKER_MAX_COOLDOWN)
+                    self.probing = False
+                    self.open_until = time.time() + self.cooldown
+                    metrics.count('breaker_opened', api=self.name)
+                    print(f'{self.name}: {self.failures} failures in a row, pausing all calls for {self.cooldown:.0f}s')
+            self._cond.notify_all()
@@ -0,0 +1,70 @@
+from forks_and_stars import BUDGET, search_repos
+
+SHARD_LIMIT = 1000   # search never returns more than this for one query
+SHARD_FILL = 0.8     # aim a bit under the cap when guessing the next range
+PER_PAGE = 100
+
+# the count field on a search hit for each sort order
+COUNT_FIELDS = {'stars': 'stargazers_count', 'forks': 'forks_count'}
+FLOORS = {'stars': 2, 'forks': 0}
+
+
+class Shard:
+    def __init__(self, field, lo, hi, total_count):
+        self.field = field
+        self.lo = lo
+        self.hi = hi
+        self.total_count = total_count
+
+    # forks shards keep the usual stars:>1 filter on top of their own range
+    @property
+    def qualifiers(self):
+        if self.field == 'stars':
+            return f'stars:{self.lo}..{self.hi}'
+        return f'stars:>1+{self.field}:{self.lo}..{self.hi}'
+
+    # only ask for pages that can have results, never the empty ones past the end
+    @property
+    def pages(self):
+        return -(-min(self.total_count, SHARD_LIMIT) // PER_PAGE)
+
+    def __repr__(self):
+        return f'{self.field}:{self.lo}..{self.hi} ({self.total_count})'
+
+
+def probe(language, shard, budget=BUDGET):
+    response = search_repos(language, shard.field, per_page=1, budget=budget, qualifiers=shard.qualifiers)
+    return response.get('total_count', 0) if response else None
+
+
+# walks the sort field from the top value downwards, handing out ranges that
+# each hold at most SHARD_LIMIT repos. every probe is one per_page=1 search;
+# the next range width is guessed from how full the last one was, and narrowed
+# whenever a guess comes back over the cap. lazy, so a small crawl only plans
+# the few shards it needs. a single value with more repos than the cap (lots of
+# repos have exactly 2 stars) can't be split further and comes out capped.
+def plan_shards(language, sort_by='stars', budget=BUDGET):
+    field = sort_by
+    floor = FLOORS[field]
+    top = search_repos(language, sort_by, per_page=1, budget=budget)
+    if not top or not top.get('items'):
+        return
+    hi = top['items'][0][COUNT_FIELDS[field]]
+    width = max(hi // 2, 1)
+
+    while hi >= floor:
+        shard = Shard(field, max(hi - width + 1, floor), hi, 0)
+        count = probe(language, shard, budget)
+        if count is None:
+            return
+        if count > SHARD_LIMIT and shard.lo < hi:
+            width = max(width // 2, 1)
+            continue
+        shard.total_count = count
+        if count > SHARD_LIMIT:
+            print(f'{language} {field}={hi} alone has {count} repos, only the first {SHARD_LIMIT} are reachable')
+        yield shard
+
+        span = hi - shard.lo + 1
+        width = max(int(span * SHARD_LIMIT * SHARD_FILL / count), 1) if count else span * 2
+        hi = shard.lo - 1
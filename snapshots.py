@@ -0,0 +1,287 @@
+import argparse
+import csv
+import glob
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+
+STORE_FILE = 'repo_snapshots.db'
+SNAPSHOT_GLOB = '*_github_repos.csv'
+TOP_K = 20
+# export_to_csv names its files <YYYYmmdd_HHMM>_github_repos.csv
+FILE_TIME = re.compile(r'(\d{8}_\d{4})_')
+TIME_FORMAT = '%Y-%m-%dT%H:%M'
+EXPORT_COLUMNS = ['id', 'name', 'url', 'stars', 'forks', 'language', 'owner', 'created_at', 'updated_at']
+
+# every exported csv folded into one history, a version per repo only when
+# something changed. what moves between runs (stars, forks, updated_at) and what
+# hardly ever does (name, owner, ...) are kept apart so a star bump doesn't copy
+# the rest of the row. url is only stored when it isn't the usual
+# github.com/<owner>/<name>. rows are only ever appended, a repo missing from a
+# later csv (e.g. an incremental --since export) just keeps its last version.
+def create_tables(cursor):
+    cursor.execute('''
+            CREATE TABLE IF NOT EXISTS snapshots (
+            id INTEGER PRIMARY KEY,
+            taken_at TEXT NOT NULL UNIQUE,
+            source TEXT NOT NULL,
+            rows INTEGER,
+            changed INTEGER,
+            ingested_at TEXT
+        );
+        ''')
+    cursor.execute('''
+            CREATE TABLE IF NOT EXISTS snapshot_counts (
+            repo_id INTEGER NOT NULL,
+            snapshot_id INTEGER NOT NULL,
+            stars INTEGER,
+            forks INTEGER,
+            updated_at TEXT,
+            PRIMARY KEY (repo_id, snapshot_id)
+            ) WITHOUT ROWID;
+        ''')
+    cursor.execute('''
+            CREATE TABLE IF NOT EXISTS snapshot_attrs (
+            repo_id INTEGER NOT NULL,
+            snapshot_id INTEGER NOT NULL,
+            name TEXT,
+            url TEXT,
+            language TEXT,
+            owner TEXT,
+            created_at TEXT,
+            PRIMARY KEY (repo_id, snapshot_id)
+            ) WITHOUT ROWID;
+        ''')
+    # which repos changed between two snapshots, without walking every repo
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_snapshot_counts_snapshot ON snapshot_counts (snapshot_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_snapshot_attrs_snapshot ON snapshot_attrs (snapshot_id)')
+
+
+def open_store(path=STORE_FILE):
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    cursor = conn.cursor()
+    create_tables(cursor)
+    conn.commit()
+    return conn
+
+
+def github_url(owner, name):
+    return f'https://github.com/{owner}/{name}'
+
+
+# '2024-09-28', '2024-09-28T20:56', '20240928_2056' (as in the file names) or 'latest'.
+# a bare date means the end of that day
+def parse_time(value):
+    if value == 'latest':
+        return '9999-12-31T23:59'
+    for fmt in ('%Y%m%d_%H%M', TIME_FORMAT, '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if fmt == '%Y-%m-%d':
+            parsed = parsed.replace(hour=23, minute=59)
+        return parsed.strftime(TIME_FORMAT)
+    raise SystemExit(f"can't read {value!r} as a time, use e.g. 2024-09-28 or 2024-09-28T20:56")
+
+
+# from the file name when it has export_to_csv's timestamp, else when it was last written
+def snapshot_time(path):
+    match = FILE_TIME.match(os.path.basename(path))
+    if match:
+        return parse_time(match.group(1))
+    return datetime.fromtimestamp(os.path.getmtime(path)).strftime(TIME_FORMAT)
+
+
+def read_snapshot(path):
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            counts = (int(row['stars']), int(row['forks']), row['updated_at'] or None)
+            url = row['url'] if row['url'] != github_url(row['owner'], row['name']) else None
+            attrs = (row['name'], url, row['language'] or None, row['owner'], row['created_at'] or None)
+            yield int(row['id']), counts, attrs
+
+
+# newest version of every repo, what the next snapshot gets diffed against
+def latest_versions(cursor):
+    counts = {repo_id: tuple(values) for repo_id, _, *values in cursor.execute('''
+            SELECT repo_id, MAX(snapshot_id), stars, forks, updated_at FROM snapshot_counts GROUP BY repo_id
+        ''')}
+    attrs = {repo_id: tuple(values) for repo_id, _, *values in cursor.execute('''
+            SELECT repo_id, MAX(snapshot_id), name, url, language, owner, created_at
+            FROM snapshot_attrs GROUP BY repo_id
+        ''')}
+    return counts, attrs
+
+
+# folds the csvs in, oldest first. files already in the store are skipped, so
+# rerunning over the same glob only picks up new exports. the history only
+# grows forward: a csv older than the newest snapshot would have to be slotted
+# in between existing versions, so it's skipped too.
+def ingest(conn, paths):
+    cursor = conn.cursor()
+    known = {source for source, in cursor.execute('SELECT source FROM snapshots')}
+    known_times = {taken_at for taken_at, in cursor.execute('SELECT taken_at FROM snapshots')}
+    newest = cursor.execute('SELECT MAX(taken_at) FROM snapshots').fetchone()[0] or ''
+    counts, attrs = latest_versions(cursor)
+
+    ingested = []
+    for taken_at, path in sorted((snapshot_time(path), path) for path in paths):
+        source = os.path.basename(path)
+        if source in known or taken_at in known_times:
+            continue
+        if taken_at <= newest:
+            print(f'skipping {source}: taken {taken_at}, before the newest snapshot ({newest})')
+            continue
+
+        cursor.execute('INSERT INTO snapshots (taken_at, source) VALUES (?, ?)', (taken_at, source))
+        snapshot_id = cursor.lastrowid
+        rows = 0
+        new_counts, new_attrs = [], []
+        for repo_id, repo_counts, repo_attrs in read_snapshot(path):
+            rows += 1
+            if counts.get(repo_id) != repo_counts:
+                counts[repo_id] = repo_counts
+                new_counts.append((repo_id, snapshot_id, *repo_counts))
+            if attrs.get(repo_id) != repo_attrs:
+                attrs[repo_id] = repo_attrs
+                new_attrs.append((repo_id, snapshot_id, *repo_attrs))
+        cursor.executemany('INSERT INTO snapshot_counts VALUES (?, ?, ?, ?, ?)', new_counts)
+        cursor.executemany('INSERT INTO snapshot_attrs VALUES (?, ?, ?, ?, ?, ?, ?)', new_attrs)
+        changed = len({row[0] for row in new_counts} | {row[0] for row in new_attrs})
+        cursor.execute('''
+                UPDATE snapshots SET rows = ?, changed = ?, ingested_at = ? WHERE id = ?
+            ''', (rows, changed, datetime.now().isoformat(timespec='seconds'), snapshot_id))
+        # one transaction per csv, a bad file doesn't leave half a snapshot behind
+        conn.commit()
+        newest = taken_at
+        ingested.append((source, taken_at, rows, changed))
+    return ingested
+
+
+# the last snapshot taken at or before `when`, None if there's none that old
+def snapshot_at(cursor, when):
+    row = cursor.execute('SELECT MAX(id) FROM snapshots WHERE taken_at <= ?', (when,)).fetchone()
+    return row[0]
+
+
+# every repo as it stood at snapshot_id, in export_to_csv's column order
+def state_as_of(cursor, snapshot_id):
+    return cursor.execute('''
+            WITH counts AS (
+                SELECT repo_id, MAX(snapshot_id), stars, forks, updated_at
+                FROM snapshot_counts WHERE snapshot_id <= :at GROUP BY repo_id
+            ), attrs AS (
+                SELECT repo_id, MAX(snapshot_id), name, url, language, owner, created_at
+                FROM snapshot_attrs WHERE snapshot_id <= :at GROUP BY repo_id
+            )
+            SELECT a.repo_id, a.name, COALESCE(a.url, 'https://github.com/' || a.owner || '/' || a.name),
+                   c.stars, c.forks, a.language, a.owner, a.created_at, c.updated_at
+            FROM attrs a JOIN counts c USING (repo_id)
+            ORDER BY c.stars DESC, a.repo_id
+        ''', {'at': snapshot_id})
+
+
+# repos whose numbers moved between two snapshots (or that first showed up in
+# between, with None for the old values). only the repos with a version in
+# (before, after] are looked at, each one via the primary key.
+def delta(cursor, before, after, by='stars'):
+    column = {'stars': 'stars', 'forks': 'forks'}[by]
+    return cursor.execute(f'''
+            SELECT r.repo_id, a.owner || '/' || a.name,
+                   old.stars, new.stars, old.forks, new.forks,
+                   new.{column} - old.{column} AS change
+            FROM (SELECT DISTINCT repo_id FROM snapshot_counts
+                  WHERE snapshot_id > :before AND snapshot_id <= :after) r
+            JOIN snapshot_counts new ON new.repo_id = r.repo_id AND new.snapshot_id = (
+                SELECT MAX(snapshot_id) FROM snapshot_counts WHERE repo_id = r.repo_id AND snapshot_id <= :after)
+            LEFT JOIN snapshot_counts old ON old.repo_id = r.repo_id AND old.snapshot_id = (
+                SELECT MAX(snapshot_id) FROM snapshot_counts WHERE repo_id = r.repo_id AND snapshot_id <= :before)
+            JOIN snapshot_attrs a ON a.repo_id = r.repo_id AND a.snapshot_id = (
+                SELECT MAX(snapshot_id) FROM snapshot_attrs WHERE repo_id = r.repo_id AND snapshot_id <= :after)
+            ORDER BY change IS NULL, change DESC, r.repo_id
+        ''', {'before': before or 0, 'after': after})
+
+
+def print_rows(header, rows, top=None):
+    print('  '.join(header))
+    for i, row in enumerate(rows):
+        if top is not None and i >= top:
+            break
+        print('  '.join('' if value is None else str(value) for value in row))
+
+
+def write_csv(filename, header, rows):
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    print(f'written to {filename}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='history of the exported repo csvs: ingest, as-of and delta queries')
+    parser.add_argument('--store', default=STORE_FILE)
+    parser.add_argument('--top', type=int, default=TOP_K)
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest_parser = commands.add_parser('ingest', help=f'fold csv snapshots in (default ./{SNAPSHOT_GLOB})')
+    ingest_parser.add_argument('files', nargs='*')
+    commands.add_parser('list', help='snapshots in the store')
+    asof = commands.add_parser('asof', help='every repo as of a time (2024-09-28, 2024-09-28T20:56 or latest)')
+    asof.add_argument('when')
+    asof.add_argument('--out', help='write the whole state here as csv, same columns as the exports')
+    changes = commands.add_parser('delta', help='what changed between two times, biggest growth first')
+    changes.add_argument('start')
+    changes.add_argument('end', nargs='?', default='latest')
+    changes.add_argument('--by', choices=['stars', 'forks'], default='stars')
+    changes.add_argument('--out', help='write every changed repo here as csv')
+    args = parser.parse_args(argv)
+
+    conn = open_store(args.store)
+    cursor = conn.cursor()
+    start = time.perf_counter()
+    try:
+        if args.command == 'ingest':
+            files = args.files or sorted(glob.glob(SNAPSHOT_GLOB))
+            for source, taken_at, rows, changed in ingest(conn, files):
+                print(f'{source}: {rows} repos, {changed} new or changed (taken {taken_at})')
+            total, = cursor.execute('SELECT COUNT(*) FROM snapshots').fetchone()
+            versions, = cursor.execute('SELECT COUNT(*) FROM snapshot_counts').fetchone()
+            print(f'{total} snapshots, {versions} count versions in {args.store}')
+
+        elif args.command == 'list':
+            print_rows(['id', 'taken_at', 'source', 'rows', 'changed'],
+                       cursor.execute('SELECT id, taken_at, source, rows, changed FROM snapshots ORDER BY id'))
+
+        elif args.command == 'asof':
+            snapshot_id = snapshot_at(cursor, parse_time(args.when))
+            if snapshot_id is None:
+                raise SystemExit(f'no snapshot as old as {args.when}')
+            rows = state_as_of(cursor, snapshot_id)
+            if args.out:
+                write_csv(args.out, EXPORT_COLUMNS, rows)
+            else:
+                print_rows(EXPORT_COLUMNS, rows, args.top)
+
+        else:
+            before = snapshot_at(cursor, parse_time(args.start))
+            after = snapshot_at(cursor, parse_time(args.end))
+            if after is None:
+                raise SystemExit(f'no snapshot as old as {args.end}')
+            header = ['repo_id', 'repo', 'stars_before', 'stars_after', 'forks_before', 'forks_after', f'{args.by}_change']
+            rows = delta(cursor, before, after, args.by)
+            if args.out:
+                write_csv(args.out, header, rows)
+            else:
+                print_rows(header, rows, args.top)
+    finally:
+        cursor.close()
+        conn.close()
+    print(f'({(time.perf_counter() - start) * 1000:.2f} ms)')
+
+
+if __name__ == "__main__":
+    main()
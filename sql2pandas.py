@@ -1,17 +1,90 @@
+import argparse
+import heapq
 import sqlite3
+
 import pandas as pd
 
-conn = sqlite3.connect('github_repos.db')
-query = "SELECT * FROM contributors WHERE contributor IS NOT NULL"
-df = pd.read_sql_query(query, conn)
-conn.close()
+DB_FILE = 'github_repos.db'
+OUTPUT_FILE = 'contributors_long_list.csv'
+MIN_CONTRIBUTIONS = 100
+CHUNK_SIZE = 10_000
+COLUMNS = ['id', 'repo_id', 'contributor', 'contributions']
+
+# first row per contributor (by id, same as drop_duplicates keep='first') plus the
+# threshold, both done in sqlite. ordinal is the row's position among all non-null
+# contributor rows, which is what the in-memory path ends up using as the index.
+STREAM_QUERY = '''
+    SELECT ordinal, id, repo_id, contributor, contributions FROM (
+        SELECT id, repo_id, contributor, contributions,
+               ROW_NUMBER() OVER (ORDER BY id) - 1 AS ordinal,
+               ROW_NUMBER() OVER (PARTITION BY contributor ORDER BY id) AS nth
+        FROM contributors
+        WHERE contributor IS NOT NULL
+    )
+    WHERE nth = 1 AND contributions >= ?
+'''
+
+
+# ties on contributions come out in table (id) order, on both paths. older
+# versions sorted unstably with no ORDER BY, so the same db gives the same rows
+# as before but tied ones can be in a different order in the csv.
+def long_list(conn, min_contributions=MIN_CONTRIBUTIONS, top=None):
+    query = "SELECT * FROM contributors WHERE contributor IS NOT NULL ORDER BY id"
+    df = pd.read_sql_query(query, conn)
+
+    df_unique = df.drop_duplicates(subset='contributor', keep='first')
+    # stable so ties keep table order, the streaming path relies on that too
+    df_sorted = df_unique.sort_values(by='contributions', ascending=False, kind='stable')
+    df_filtered = df_sorted[df_sorted['contributions'] >= min_contributions]
+    return df_filtered if top is None else df_filtered.head(top)
+
+
+# same result without ever holding the table: rows come off the cursor chunk_size
+# at a time and only the best `top` survive in a heap (all qualifying rows if top
+# is None, which is still just the long list rather than the whole table)
+def long_list_streaming(conn, min_contributions=MIN_CONTRIBUTIONS, top=None, chunk_size=CHUNK_SIZE):
+    cursor = conn.execute(STREAM_QUERY, (min_contributions,))
+    heap = []
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        for row in rows:
+            # more contributions wins, earlier row wins a tie
+            entry = (row[4], -row[0], row)
+            if top is None or len(heap) < top:
+                heapq.heappush(heap, entry)
+            else:
+                heapq.heappushpop(heap, entry)
+
+    ranked = [row for _, _, row in sorted(heap, reverse=True)]
+    return pd.DataFrame([row[1:] for row in ranked], index=[row[0] for row in ranked], columns=COLUMNS)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='contributors with the most contributions, one row each',
+        epilog='rows with equal contributions are listed in table order (by id). csvs from older versions '
+               'have the same rows, but tied ones may be in a different order.',
+    )
+    parser.add_argument('--db', default=DB_FILE)
+    parser.add_argument('--out', default=OUTPUT_FILE)
+    parser.add_argument('--min-contributions', type=int, default=MIN_CONTRIBUTIONS)
+    parser.add_argument('--top', type=int, help='only keep the top N')
+    parser.add_argument('--stream', action='store_true', help='chunked, bounded-memory version')
+    args = parser.parse_args()
 
-pd.set_option('display.max_columns', None)
+    conn = sqlite3.connect(args.db)
+    if args.stream:
+        df_filtered = long_list_streaming(conn, args.min_contributions, args.top)
+    else:
+        df_filtered = long_list(conn, args.min_contributions, args.top)
+    conn.close()
 
-df_unique = df.drop_duplicates(subset='contributor', keep='first')
-df_sorted = df_unique.sort_values(by='contributions', ascending=False)
-df_filtered = df_sorted[df_sorted['contributions'] >= 100]
+    pd.set_option('display.max_columns', None)
 
+    df_filtered.to_csv(args.out)
 
-df_filtered.to_csv('contributors_long_list.csv')
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the scripts live at the repo root and the fake api in benchmarks/, neither is a package
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, 'benchmarks'))
@@ -0,0 +1,91 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import forks_and_stars
+import http_cache
+from async_crawler import AsyncCrawler
+from conftest import REPO_ROOT
+from fake_api import FakeAPI
+from rate_limit import RateLimitBudget
+
+CORPUS_DB = os.path.join(REPO_ROOT, 'new_github_repos.db')
+
+
+# the fake github serves the bundled db's repos and contributors on localhost,
+# the crawl runs in a scratch dir so the http cache and db start out empty
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    api = FakeAPI(CORPUS_DB).start()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(forks_and_stars, 'API_BASE', api.url)
+    monkeypatch.setattr(forks_and_stars, '_config', {'GITHUB_TOKEN': 'test-token'})
+    monkeypatch.setattr(http_cache, '_cache', None)
+    yield api
+    api.stop()
+
+
+def crawl(cursor, **kwargs):
+    crawler = AsyncCrawler(cursor, budget=RateLimitBudget(['test-token']))
+    try:
+        asyncio.run(crawler.crawl_all(**kwargs))
+    finally:
+        crawler.close()
+
+
+def test_crawl_all_stores_repos_contributors_and_processed(api):
+    conn = sqlite3.connect('crawl.db')
+    cursor = conn.cursor()
+    forks_and_stars.create_tables(cursor)
+
+    crawl(cursor, languages=['Java'], sort_orders=['stars'], num_repos=150)
+    conn.commit()
+
+    _, page = api.search({'q': ['language:Java'], 'sort': ['stars'], 'per_page': ['300']})
+    ranked = [repo['id'] for repo in page['items']]
+    expected = ranked[:150]
+    stored = [row[0] for row in cursor.execute('SELECT id FROM repositories')]
+    assert sorted(stored) == sorted(expected)
+
+    contributors = sum(min(len(api.contributors.get(repo_id, [])), forks_and_stars.NUM_CONTRIBUTORS) for repo_id in expected)
+    assert cursor.execute('SELECT COUNT(*) FROM contributors').fetchone()[0] == contributors
+    assert cursor.execute(
+        "SELECT COUNT(*) FROM processed_repos WHERE language = 'Java' AND sort_by = 'stars'"
+    ).fetchone()[0] == 150
+
+    # a second run skips what's processed and carries on with the next 150
+    crawl(cursor, languages=['Java'], sort_orders=['stars'], num_repos=150)
+    conn.commit()
+    stored = [row[0] for row in cursor.execute('SELECT id FROM repositories')]
+    assert sorted(stored) == sorted(ranked)
+    contributors = sum(min(len(api.contributors.get(repo_id, [])), forks_and_stars.NUM_CONTRIBUTORS) for repo_id in ranked)
+    assert cursor.execute('SELECT COUNT(*) FROM contributors').fetchone()[0] == contributors
+    assert cursor.execute('SELECT COUNT(*) FROM processed_repos').fetchone()[0] == 300
+    conn.close()
+
+
+def test_budget_waits_once_remaining_hits_zero():
+    budget = RateLimitBudget(['only-token'])
+    url = 'https://api.github.com/repos/x/y/contributors'
+    with budget.slot(url) as slot:
+        slot.observe({'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(int(time.time()) + 1)})
+
+    acquired = threading.Event()
+
+    def request():
+        with budget.slot(url):
+            acquired.set()
+
+    thread = threading.Thread(target=request, daemon=True)
+    start = time.monotonic()
+    thread.start()
+    # still blocked while the window hasn't reset
+    assert not acquired.wait(0.5)
+    thread.join(timeout=5)
+    assert acquired.is_set()
+    assert time.monotonic() - start >= 1
+    assert budget.waits >= 1
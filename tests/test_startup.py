@@ -0,0 +1,29 @@
+import os
+import sqlite3
+
+import pytest
+
+from startup import BUDGET_MS, CASES, HEAVY, loaded, run_case
+
+RUNS = 3    # best of, the first run also pays for .pyc files and a cold disk cache
+
+
+# same checks as benchmarks/startup.py: no heavy module a command doesn't need,
+# and its imports within budget
+@pytest.fixture(scope='module')
+def work(tmp_path_factory):
+    work = tmp_path_factory.mktemp('startup')
+    sqlite3.connect(os.path.join(work, 'empty.db')).close()
+    return str(work)
+
+
+@pytest.mark.parametrize('name, args, allowed, budget_ms', CASES, ids=[case[0] for case in CASES])
+def test_command_startup(work, name, args, allowed, budget_ms):
+    runs = [run_case(args, work) for _ in range(RUNS)]
+    modules = min(runs, key=lambda modules: sum(m[1] for m in modules))
+
+    heavy = [package for package in HEAVY if package not in allowed and loaded(modules, package)]
+    assert not heavy, f'gitgrab {" ".join(args)} imports {", ".join(heavy)}'
+
+    total_ms = sum(self_us for _, self_us, _, _ in modules) / 1000
+    assert total_ms <= (budget_ms or BUDGET_MS), f'{total_ms:.0f} ms of imports'
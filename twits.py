@@ -1,3 +1,4 @@
+import re
 import tweepy
 import pandas as pd
 import json
@@ -5,45 +6,90 @@ from collections import Counter
 from datetime import datetime
 
 time_stamp = datetime.now().strftime("%Y%m%d_%H%M")
+CONFIG_FILE = 'config.json'
 
+_api = None
 
-with open('config.json') as f:
-    config = json.load(f)
-API_KEY =  config['API_KEY']
-API_SECRET_KEY = config['API_SECRET_KEY']
-ACCESS_TOKEN = config['ACCESS_TOKEN']
-ACCESS_TOKEN_SECRET = config['ACCESS_TOKEN_SECRET']
+# credentials are only read once something actually searches
+def get_api():
+    global _api
+    if _api is None:
+        with open(CONFIG_FILE) as f:
+            config = json.load(f)
+        auth = tweepy.OAuthHandler(config['API_KEY'], config['API_SECRET_KEY'])
+        auth.set_access_token(config['ACCESS_TOKEN'], config['ACCESS_TOKEN_SECRET'])
+        _api = tweepy.API(auth, wait_on_rate_limit=True)
+    return _api
 
-auth = tweepy.OAuthHandler(API_KEY, API_SECRET_KEY)
-auth.set_access_token(ACCESS_TOKEN, ACCESS_TOKEN_SECRET)
-api = tweepy.API(auth, wait_on_rate_limit=True)
+ROLE_PHRASES = ['open source', 'programmer', 'machine learning', 'developer']
+TWEETS_PER_KEYWORD = 20
+MAX_QUERY_LENGTH = 500  # standard search rejects longer queries
+
+# pack keywords into as few OR queries as fit under the length limit
+def build_queries(keywords, max_length=MAX_QUERY_LENGTH):
+    groups = []
+    for keyword in keywords:
+        term = f'"{keyword}"' if ' ' in keyword else keyword
+        if groups and len(groups[-1][0]) + len(' OR ') + len(term) <= max_length:
+            groups[-1][0] += f' OR {term}'
+            groups[-1][1].append(keyword)
+        else:
+            groups.append([term, [keyword]])
+    return [(query, group) for query, group in groups]
+
+# whole words only, so 'Java' doesn't match every JavaScript tweet. lookarounds
+# instead of \b because of keywords like 'C#' that end in a non-word character
+def keyword_pattern(keywords):
+    alternatives = '|'.join(re.escape(keyword.lower()) for keyword in keywords)
+    return re.compile(rf'(?<!\w)(?:{alternatives})(?!\w)')
 
 def search_users(keywords, users_per_keyword = 10, min_followers = 1000):
     users = {}
-    for keyword in keywords:
-        keyword_users = []
-        for tweet in tweepy.Cursor(api.search_tweets, q=keyword, lang='en', tweet_mode='extended').items(20):
+    qualifies = {}  # screen_name -> bool, each profile only gets checked once
+    for query, group in build_queries(keywords):
+        found = {keyword: 0 for keyword in group}
+        active = set(group)
+        pattern = keyword_pattern(group)
+        by_text = {keyword.lower(): keyword for keyword in group}
+        for tweet in tweepy.Cursor(get_api().search_tweets, q=query, lang='en', tweet_mode='extended').items(TWEETS_PER_KEYWORD * len(group)):
+            # one query covers several keywords, credit the ones this tweet actually mentions
+            mentioned = {by_text[match] for match in pattern.findall(tweet.full_text.lower())}
+            matched = [keyword for keyword in group if keyword in active and keyword in mentioned]
+            if not matched:
+                continue
+
             user = tweet.user
-            if user.followers_count >= min_followers and user.screen_name not in users:
-                if any(keyword in user.description.lower() for keyword in ['open source', 'programmer', 'machine learning', 'developer']):
-                    users[user.screen_name] = {
-                        'username': user.screen_name,
-                        'name': user.name,
-                        'description': user.description,
-                        'followers_count': user.followers_count,
-                        'keywords': [keyword],
-                        'tweet_count': 1,
-                        'like_count': tweet.favorite_count
-                    }
-                    keyword_users.append(user.screen_name)
-                
-            elif user.screen_name in users:
-                users[user.screen_name]['keywords'].append(keyword)
-                users[user.screen_name]['tweet_count'] += 1
-                users[user.screen_name]['quote_count'] += tweet.quote_count
-                users[user.screen_name]['like_count'] += tweet.favorite_count
-                              
-            if len(keyword_users) >= users_per_keyword:
+            if user.screen_name not in qualifies:
+                description = (user.description or '').lower()
+                qualifies[user.screen_name] = (
+                    user.followers_count >= min_followers and
+                    any(phrase in description for phrase in ROLE_PHRASES)
+                )
+
+            if user.screen_name in users:
+                record = users[user.screen_name]
+                record['keywords'].extend(matched)
+                record['tweet_count'] += 1
+                record['quote_count'] += getattr(tweet, 'quote_count', 0) or 0
+                record['like_count'] += tweet.favorite_count
+            elif qualifies[user.screen_name]:
+                users[user.screen_name] = {
+                    'username': user.screen_name,
+                    'name': user.name,
+                    'description': user.description,
+                    'followers_count': user.followers_count,
+                    'keywords': list(matched),
+                    'tweet_count': 1,
+                    'quote_count': getattr(tweet, 'quote_count', 0) or 0,
+                    'like_count': tweet.favorite_count
+                }
+                for keyword in matched:
+                    found[keyword] += 1
+                    if found[keyword] >= users_per_keyword:
+                        active.discard(keyword)
+
+            # every keyword in this query has its users, stop paging
+            if not active:
                 break
     return list(users.values())
 
@@ -1,52 +1,162 @@
 import tweepy
 import pandas as pd
 import json
+import argparse
+import threading
 from datetime import datetime
-import time
-from collections import defaultdict
+from collections import deque
 import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import metrics
+from retry import RetryPolicy
 
 time_stamp = datetime.now().strftime("%Y%m%d_%H%M")
 output_file = f'{time_stamp}_twitter_users.csv'
+# progress while hydrating goes here, output_file is only written once at the end
+checkpoint_file = f'{time_stamp}_twitter_users.checkpoint.csv'
+USER_STORE_FILE = 'twitter_users.db'
+HYDRATE_WORKERS = 4
+OUTPUT_COLUMNS = ['username', 'name', 'description', 'followers_count', 'keywords', 'relevance_score']
+CONFIG_FILE = 'config.json'
 
-with open('config.json') as f:
-    config = json.load(f)
+_client = None
+_client_lock = threading.Lock()
 
-client = tweepy.Client(
-    bearer_token=config['BEARER_TOKEN'],
-    consumer_key=config['API_KEY'],
-    consumer_secret=config['API_SECRET_KEY'],
-    access_token=config['ACCESS_TOKEN'],
-    access_token_secret=config['ACCESS_TOKEN_SECRET']
-)
+# built on first use, importing this (or --help) doesn't need config.json
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            with open(CONFIG_FILE) as f:
+                config = json.load(f)
+            _client = tweepy.Client(
+                bearer_token=config['BEARER_TOKEN'],
+                consumer_key=config['API_KEY'],
+                consumer_secret=config['API_SECRET_KEY'],
+                access_token=config['ACCESS_TOKEN'],
+                access_token_secret=config['ACCESS_TOKEN_SECRET']
+            )
+    return _client
 
-def rate_limited_request(func, *args, **kwargs):
-    try:
-        return func(*args, **kwargs)
-    except tweepy.TooManyRequests:
-        print("Rate limit reached. Waiting for 15 minutes.")
-        time.sleep(15 * 60)
-        return func(*args, **kwargs)
-    except tweepy.TwitterServerError:
-        print("Twitter server error. Waiting for 1 minute.")
-        time.sleep(60)
+# when any request gets a 429 everyone holds off until the window resets,
+# 5xx / network errors back off with jitter, see retry.py
+RETRY = RetryPolicy('twitter', default_rate_wait=15 * 60, retry_on=(tweepy.HTTPException,))
+
+def timed_request(func, *args, **kwargs):
+    with metrics.timer('twitter.http'):
         return func(*args, **kwargs)
 
-def fetch_users(usernames):
+def rate_limited_request(func, *args, **kwargs):
+    return RETRY.call(lambda: timed_request(func, *args, **kwargs), describe=func.__name__)
+
+# for tweepy.Paginator, which goes by the method's name (so keep this one's) to
+# pick its paging parameter. a page we gave up on ends the search rather than crashing it
+def search_recent_tweets(*args, **kwargs):
+    return rate_limited_request(get_client().search_recent_tweets, *args, **kwargs) or {}
+
+def fetch_users(user_ids):
     users = rate_limited_request(
-        client.get_users,
-        usernames=usernames,
+        get_client().get_users,
+        ids=user_ids,
         user_fields=['description', 'public_metrics']
     )
-    return users.data if users else []
+    return users.data or [] if users else []
+
+
+# aho-corasick over the lowercased keywords, built once. one pass over a
+# description finds every keyword in it (overlaps included), instead of
+# lowercasing and scanning it once per keyword
+class KeywordMatcher:
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [set()]
+        for i, keyword in enumerate(self.keywords):
+            node = 0
+            for ch in keyword.lower():
+                if ch not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(set())
+                    self.goto[node][ch] = len(self.goto) - 1
+                node = self.goto[node][ch]
+            self.out[node].add(i)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(ch, 0)
+                self.out[child] |= self.out[self.fail[child]]
+
+    # matched keywords, in the order they were given
+    def match(self, text):
+        node = 0
+        found = set(self.out[0])
+        for ch in (text or '').lower():
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            if self.out[node]:
+                found |= self.out[node]
+        return [self.keywords[i] for i in sorted(found)]
+
+
+# hydrated users get checkpointed here so a re-run only fetches the ones it's missing
+def open_user_store(filename=USER_STORE_FILE):
+    store = sqlite3.connect(filename)
+    store.execute('''
+            CREATE TABLE IF NOT EXISTS hydrated_users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            name TEXT,
+            description TEXT,
+            followers_count INTEGER,
+            hydrated_at TEXT
+            );
+        ''')
+    return store
+
+def load_hydrated(store, user_ids):
+    hydrated = {}
+    ids = list(user_ids)
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i+500]
+        rows = store.execute(f'''
+                SELECT user_id, username, name, description, followers_count FROM hydrated_users
+                WHERE user_id IN ({','.join('?' * len(chunk))})
+            ''', chunk)
+        for user_id, *fields in rows:
+            hydrated[user_id] = fields
+    return hydrated
 
+@metrics.timed('db.save_users')
+def save_hydrated(store, users):
+    store.executemany('''
+            INSERT OR REPLACE INTO hydrated_users (user_id, username, name, description, followers_count, hydrated_at)
+            VALUES (?, ?, ?, ?, ?, datetime('now'))
+        ''', [(int(user.id), user.username, user.name, user.description, user.public_metrics['followers_count'])
+          for user in users])
+    with metrics.timer('db.commit'):
+        store.commit()
+    metrics.count('db_rows', len(users), table='hydrated_users')
+
+# tweepy's paginator does the paging, so this one is timed as a whole
+@metrics.timed('twitter.search')
 def search_users(keywords, max_users=200):
     all_users = []
     user_set = set()
     
     for keyword in keywords:
         query = f"{keyword} -is:retweet"
-        for tweet in tweepy.Paginator(client.search_recent_tweets, query=query, 
+        for tweet in tweepy.Paginator(search_recent_tweets, query=query, 
                                       tweet_fields=['author_id'], max_results=100).flatten(limit=1000):
             if tweet.author_id not in user_set:
                 user_set.add(tweet.author_id)
@@ -61,56 +171,90 @@ def search_users(keywords, max_users=200):
     return all_users[:max_users]
 
 
-def process_users(user_ids, keywords, save_batch_size=20):
+def process_users(user_ids, keywords, save_batch_size=20, store_file=USER_STORE_FILE, workers=HYDRATE_WORKERS):
+    matcher = KeywordMatcher(keywords)
+    store = open_user_store(store_file)
+    hydrated = load_hydrated(store, user_ids)
+    missing = [user_id for user_id in user_ids if int(user_id) not in hydrated]
+    print(f'{len(hydrated)} users already hydrated, fetching {len(missing)}')
+
     users_data = []
     api_calls = 0
-    for i in range(0, len(user_ids), 100):
-        batch = user_ids[i:i+100]
-        users = fetch_users(batch)
-        api_calls += 1
-        
-        for user in users:
-            user_data = {
-                'username': user.username,
-                'name': user.name,
-                'description': user.description,
-                'followers_count': user.public_metrics['followers_count'],
-                'keywords': [kw for kw in keywords if kw.lower() in user.description.lower()],
-            }
-            
-            users_data.append(user_data)
-            
-            if len(users_data) % save_batch_size == 0:
-                save_to_csv(users_data[-save_batch_size:], output_file, append=(len(users_data) > save_batch_size))
-                print(f'saved batch of {save_batch_size} users.  processed so far: {len(users_data)}')
+
+    def add_user(username, name, description, followers_count):
+        users_data.append({
+            'username': username,
+            'name': name,
+            'description': description,
+            'followers_count': followers_count,
+            'keywords': matcher.match(description),
+        })
+        if len(users_data) % save_batch_size == 0:
+            save_to_csv(users_data[-save_batch_size:], checkpoint_file, append=True)
+            print(f'saved batch of {save_batch_size} users.  processed so far: {len(users_data)}')
+
+    for fields in hydrated.values():
+        add_user(*fields)
+
+    # batches go out concurrently, results are checkpointed as they land
+    batches = [missing[i:i+100] for i in range(0, len(missing), 100)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in as_completed([executor.submit(fetch_users, batch) for batch in batches]):
+            users = future.result()
+            api_calls += 1
+            save_hydrated(store, users)
+
+            for user in users:
+                add_user(user.username, user.name, user.description, user.public_metrics['followers_count'])
+    store.close()
                       
     remaining = len(users_data) % save_batch_size
     if remaining > 0:
-        save_to_csv(users_data[-remaining:], output_file, append=True)
+        save_to_csv(users_data[-remaining:], checkpoint_file, append=True)
         print(f'saved final batch of {remaining} users.  total processed: {len(users_data)}')
         
     print(f'total API calls for user-search: {api_calls}')
     return users_data
 
+def to_output_frame(data):
+    df = pd.DataFrame(data, columns=OUTPUT_COLUMNS if not len(data) else None)
+    df['keywords'] = df['keywords'].map(lambda x: ', '.join(dict.fromkeys(x)))
+    return df
+
+# append only adds a header when starting a new file
+@metrics.timed('csv.save_users')
 def save_to_csv(data, filename, append=False):
-    df = pd.DataFrame(data)
-    df['keywords'] = df['keywords'].apply(lambda x: ', '.join(set(x)))
+    df = data if isinstance(data, pd.DataFrame) else to_output_frame(data)
     mode = 'a' if append else 'w'
-    header = not append
+    header = not (append and os.path.exists(filename))
     df.to_csv(filename, mode=mode, header=header, index=False)
+    metrics.count('csv_rows', len(df), file='checkpoint' if append else 'output')
 
 
-def rank_users(users):
-    for user in users:
-        user['relevance_score'] = (
-            len(user['keywords']) * 10 +
-            min(user['followers_count'], 10000) / 100
-        )
-    return sorted(users, key=lambda x: x['relevance_score'], reverse=True)
+# scored in one go over the frame. ties keep hydration order (stable sort, same
+# as sorted() did); top_k just takes the k best via nlargest instead of sorting everyone
+def rank_users(users, top_k=None):
+    df = pd.DataFrame(users, columns=OUTPUT_COLUMNS[:-1] if not users else None)
+    df['relevance_score'] = (
+        df['keywords'].str.len() * 10 +
+        df['followers_count'].clip(upper=10000) / 100
+    )
+    if top_k is not None:
+        return df.nlargest(top_k, 'relevance_score', keep='first')
+    return df.sort_values('relevance_score', ascending=False, kind='stable')
 
 
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='find and rank twitter users tweeting about the keywords')
+    parser.add_argument('--metrics-file', help='write stage timings/counters here in prometheus text format')
+    parser.add_argument('--profile', metavar='FILE', help='run under cProfile and dump the stats here')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    profiler = metrics.start_profile(args.profile)
     
     keywords = ['Java', 'TypeScript', 'C#', 'open source', 'coding', 'programming']
     max_users = 200
@@ -122,20 +266,23 @@ def main():
     print(f"Found {len(user_ids)} unique users")
 
     print("Fetching user details...")
-    users = process_users(user_ids, keywords)
+    users = process_users(user_ids, keywords, save_batch_size)
     print(f"Processed {len(users)} users")
 
     print("Ranking users...")
-    ranked_users = rank_users(users)
+    ranked = to_output_frame(rank_users(users))
 
 
 # save and rank
-    save_to_csv(ranked_users, output_file)
+    save_to_csv(ranked, output_file)
     print(f"Final ranked user data saved to {output_file}")
 
+    # nlargest picks the same ten as the full sort (ties keep their order in both)
+    top = to_output_frame(rank_users(users, top_k=10))
     print('\nTop ten users:')
-    df = pd.read_csv(output_file)
-    print(df[['username', 'name', 'followers_count', 'keywords', 'relevance_score']].head(10).to_string(index=False))
+    print(top[['username', 'name', 'followers_count', 'keywords', 'relevance_score']].to_string(index=False))
+
+    metrics.report(args.metrics_file, profiler, args.profile)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()